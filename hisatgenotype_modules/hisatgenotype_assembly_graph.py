@@ -194,6 +194,8 @@ class Node:
 
         # sequence that node represents
         #   with information about how the sequence is related to backbone
+        if isinstance(seq, (bytes, bytearray)):
+            seq = seq.decode("ascii")
         assert len(seq) == len(var)
         assert len(seq) == len(qual)
         self.seq     = []
@@ -1180,7 +1182,7 @@ class Graph:
                                j, 
                                ids, 
                                len(num_ids), 
-                               sorted(list(num_ids))[:20], 
+                               sorted(num_ids)[:20], 
                                alleles, 
                               file=sys.stderr)
                     print("\n", file=sys.stderr)
@@ -1220,7 +1222,7 @@ class Graph:
                                 # ... and for each contig at a position ...
                                 for l in range(len(classes)):
                                     mx.append([])
-                                    num_id    = sorted(list(classes[l][1]))[0]
+                                    num_id    = sorted(classes[l][1])[0]
                                     node_id   = "(%d-%d)%s" \
                                                     % (k, l, num_to_id[num_id])
                                     node      = self.nodes2[node_id]
@@ -1274,7 +1276,7 @@ class Graph:
                     for i in range(len(equiv_list)):
                         classes = equiv_list[i]
                         for j in range(len(classes)):
-                            num_ids     = sorted(list(classes[j][1]))
+                            num_ids     = sorted(classes[j][1])
                             node_id     = "(%d-%d)%s" \
                                              % (i, j, num_to_id[num_ids[0]])
                             node        = self.nodes2[node_id]
@@ -1357,7 +1359,7 @@ class Graph:
                     classes = equiv_list[i]
                     for j in range(len(classes)):
                         ids, num_ids, all_ids, alleles = classes[j]
-                        num_ids = sorted(list(num_ids))
+                        num_ids = sorted(num_ids)
 
                         if print_msg: 
                             print((i, j, num_ids), 
@@ -1432,8 +1434,8 @@ class Graph:
                           j, 
                           k):
                 if known_alleles:
-                    num_id1 = sorted(list(classes[i][1]))[0]
-                    num_id2 = sorted(list(classes2[j][1]))[0]
+                    num_id1 = sorted(classes[i][1])[0]
+                    num_id2 = sorted(classes2[j][1])[0]
 
                     node_id1 = "(%d-%d)%s" % (best_i, i, num_to_id[num_id1])
                     node_id2 = "(%d-%d)%s" % (best_i2, j, num_to_id[num_id2])
@@ -1452,7 +1454,7 @@ class Graph:
                          k):
                 if known_alleles:
                     num_ids  = classes2[j][1]
-                    num_ids  = sorted(list(num_ids))
+                    num_ids  = sorted(num_ids)
                     num_id   = num_ids[0]
                     node_id  = "(%d-%d)%s" % (best_i2, j, num_to_id[num_id])
                     node_id2 = "(%d-%d)%s" % (best_i, k, num_to_id[num_id])
@@ -1464,7 +1466,7 @@ class Graph:
             def add_remove(classes, i):
                 if known_alleles:
                     num_ids = classes[i][1]
-                    num_ids = sorted(list(num_ids))
+                    num_ids = sorted(num_ids)
                     num_id  = num_ids[0]
                     node_id = "(%d-%d)%s" % (best_i, i, num_to_id[num_id])
                     remove_list.append([node_id])
@@ -27,6 +27,7 @@ import math
 import random
 import errno
 import json
+import functools
 from copy import deepcopy
 from datetime import datetime
 import hisatgenotype_typing_process as typing_process
@@ -135,6 +136,12 @@ def key_sortAllele(x):
 
     return tuple([gen, val] + allelefields)
 
+""" Sorting key for variant IDs such as 'hv123', by their numeric suffix """
+""" Recently seen IDs are cached so repeated sorts skip the parse """
+@functools.lru_cache(maxsize = 4096)
+def key_sortVar(var_id):
+    return int(var_id[2:])
+
 """ Sorting allele or gene names"""
 def sort_genall(list_, alleles = False):
     try:
@@ -339,11 +346,13 @@ def read_allele_seq(fname, dic = {}, genes = False):
 def read_variants(fname, genes = False):
     vardata  = {}
     varlist  = {}
-    variants = open(fname, 'r').read()
-    variants = variants.strip("\n").split("\n")
-    while variants:
-        varset = variants.pop(0)
+    variants = open(fname, 'r')
+    for varset in variants: # one record at a time; no copy of the file
+        varset = varset.rstrip("\n")
+        if not varset:
+            continue
         var_id, var_type, name, pos, var = varset.split("\t")
+        var_id = sys.intern(var_id)
         if var_type == 'Deletion':
             var = int(var)
         pos  = int(pos)
@@ -359,6 +368,7 @@ def read_variants(fname, genes = False):
             varlist[gene].append([pos, var_id])
         else:
             varlist[gene].append([pos, var_type, var, var_id])
+    variants.close()
     for gene in varlist:
         varlist[gene].sort(key = lambda x: x[0])
     
@@ -392,7 +402,9 @@ def read_links(fname, aslist = False):
     while linklist:
         link = linklist.pop(0)
         link = link.replace(" ", "\t").split("\t")
-        var_id, allele_names = link[0], link[1:]
+        # Interned so the many repeats of an allele name share one object
+        #   and dict lookups on ids compare by identity
+        var_id, allele_names = sys.intern(link[0]), list(map(sys.intern, link[1:]))
         if aslist:
             # Make sure aslist is handled properly otherwise error if dic append
             links.append([var_id, allele_names])
@@ -896,7 +908,7 @@ def simulate_reads(seq_dic,         # seq_dic["A"]["A*24:36N"] = "ACGTCCG ..."
                     assert var_id.startswith("hv")
                     var_ids.append(var_id)
 
-            var_ids = sorted(var_ids, key = lambda x: int(x[2:]))
+            var_ids = sorted(var_ids, key = key_sortVar)
 
             # Build annotated sequence for the allele w.r.t backbone sequence
             add_pos = 0
@@ -1069,7 +1081,7 @@ def get_mpileup(alignview_cmd,
     proc = subprocess.Popen(alignview_cmd,
                             universal_newlines = True,
                             stdout = subprocess.PIPE,
-                            stderr = open("/dev/null", 'w'))
+                            stderr = subprocess.DEVNULL)
 
     prev_pos = -1
     cigar_re = re.compile('\d+\w')
@@ -1190,13 +1202,15 @@ def get_pair_interdist(alignview_cmd,
     bamview_proc = subprocess.Popen(alignview_cmd,
                                     universal_newlines = True,
                                     stdout = subprocess.PIPE,
-                                    stderr = open("/dev/null", 'w'))
+                                    stderr = subprocess.DEVNULL)
     sort_read_cmd = ["sort", "-k", "1,1", "-s"] # -s for stable sorting
     alignview_proc = subprocess.Popen(sort_read_cmd,
                                       universal_newlines = True,
+                                      bufsize = 1 << 20,
                                       stdin  = bamview_proc.stdout,
                                       stdout = subprocess.PIPE,
-                                      stderr = open("/dev/null", 'w'))
+                                      stderr = subprocess.DEVNULL)
+    bamview_proc.stdout.close() # sort now owns the pipe
 
     dist_list    = []
     prev_read_id = None
@@ -1254,6 +1268,9 @@ def get_pair_interdist(alignview_cmd,
 
         reads.append([left_pos, right_pos - 1])
         prev_read_id = read_id
+    alignview_proc.stdout.close()
+    alignview_proc.wait()
+    bamview_proc.wait()
 
     dist_list = sorted(dist_list)
     dist_avg  = sum(dist_list) / max(1, len(dist_list))
@@ -27,8 +27,15 @@ import random
 import math
 import multiprocessing
 import json
+import io
+import glob
+import bisect
+import itertools
+import functools
+import heapq
+import collections
+from operator import itemgetter
 from datetime import datetime, date, time
-from copy import deepcopy
 import hisatgenotype_typing_common as typing_common
 import hisatgenotype_assembly_graph as assembly_graph
 import hisatgenotype_validation_check as validation_check
@@ -41,6 +48,12 @@ with open(setting_file, "r") as ifi:
 
 SANITY_CHECK = settings["sanity_check"]
 
+""" Per-event invariants in the alignment parsing loop; off for normal runs """
+DEBUG_TYPING = False
+
+""" Comparison types that carry a variant id, e.g. ["deletion", 100, 3, "hv5"] """
+_VAR_CMP_TYPES = frozenset(["mismatch", "deletion", "insertion"])
+
 # Needed to check for strings and as compatability with python2
 if not hasattr(__builtins__, "basestring"):
     basestring = (str, bytes)
@@ -48,34 +61,75 @@ if not hasattr(__builtins__, "basestring"):
 # --------------------------------------------------------------------------- #
 # Base functions for handling variants                                        #
 # --------------------------------------------------------------------------- #
+"""
+Implicit interval tree over exons (cgranges-style)
+   Intervals are sorted by their left ends and augmented with a prefix
+   maximum of their right ends, so a containment query only needs a binary
+   search instead of a scan over every exon
+"""
+class IITree:
+    def __init__(self, intervals):
+        intervals       = sorted([left, right] for left, right in intervals)
+        self.lefts      = [left for left, _ in intervals]
+        self.rights     = [right for _, right in intervals]
+        self.max_rights = list(itertools.accumulate(self.rights, max))
+
+    # Is [left, right] contained within any of the intervals?
+    def contains(self, left, right):
+        idx = bisect.bisect_right(self.lefts, left) - 1
+        return idx >= 0 and self.max_rights[idx] >= right
+
+    # Batched version of contains over parallel lists of lefts and rights
+    def contains_many(self, lefts, rights):
+        max_rights = self.max_rights
+        idxs       = map(bisect.bisect_right, itertools.repeat(self.lefts), lefts)
+        return [idx > 0 and max_rights[idx - 1] >= right 
+                    for idx, right in zip(idxs, rights)]
+
+""" 
+Items selected by the set bits of an int bitmask, bit i selecting items[i] 
+"""
+_BIT_TABLE = bytes.maketrans(b"01", b"\x00\x01")
+def mask_to_items(mask, items):
+    bits = bin(mask)[:1:-1].encode("ascii").translate(_BIT_TABLE)
+    return itertools.compress(items, bits)
+
+""" Rightmost base covered by a variant; deletions span int(var_data) bases """
+def get_var_right(var):
+    var_type, var_left, var_data = var
+    if var_type == "deletion":
+        return var_left + int(var_data) - 1
+    return var_left
+
+""" IITree of an exon list, built once per distinct list of exons """
+@functools.lru_cache(maxsize = 64)
+def _build_exon_tree(exons):
+    return IITree(exons)
+
+""" exons as an IITree; plain lists are looked up by value in the cache """
+def get_exon_tree(exons):
+    if isinstance(exons, IITree):
+        return exons
+    return _build_exon_tree(tuple(map(tuple, exons)))
+
 """
    var: ['single', 3300, 'G']
    exons: [[301, 373], [504, 822], [1084, 1417], [2019, 2301], ...]
+          or an IITree built from them
 """
 def var_in_exon(var, exons):
-    exonic = False
-    var_type, var_left, var_data = var
-    var_right = var_left
-    if var_type == "deletion":
-        var_right = var_left + int(var_data) - 1
-    for exon_left, exon_right in exons:
-        if var_left >= exon_left and var_right <= exon_right:
-            return True
-    return False
+    exons = get_exon_tree(exons)
+    return exons.contains(var[1], get_var_right(var))
 
 """ Report variant IDs whose var is within exonic regions """
 def get_exonic_vars(Vars, exons):
-    vars = set()
-    for var_id, var in Vars.items():
-        var_type, var_left, var_data = var
-        var_right = var_left
-        if var_type == "deletion":
-            var_right = var_left + int(var_data) - 1
-        for exon_left, exon_right in exons:
-            if var_left >= exon_left and var_right <= exon_right:
-                vars.add(var_id)
-                
-    return vars
+    exons      = get_exon_tree(exons)
+    var_ids    = list(Vars.keys())
+    var_lefts  = [var[1] for var in Vars.values()]
+    var_rights = [get_var_right(var) for var in Vars.values()]
+
+    return set(itertools.compress(var_ids, 
+                                  exons.contains_many(var_lefts, var_rights)))
 
 # --------------------------------------------------------------------------- #
 # Functions for Allele parsing                                                #
@@ -91,16 +145,12 @@ def get_rep_alleles(Links, exon_vars, in_alleles = None):
         for allele in alleles:
             if in_alleles != None and allele not in in_alleles:
                 continue
-            if allele not in allele_vars:
-                allele_vars[allele] = set()
-            allele_vars[allele].add(var)
+            allele_vars.setdefault(allele, set()).add(var)
 
+    # Group alleles by their exact set of exonic variants
     allele_groups = {}
     for allele, vars in allele_vars.items():
-        vars = '-'.join(vars)
-        if vars not in allele_groups:
-            allele_groups[vars] = []
-        allele_groups[vars].append(allele)
+        allele_groups.setdefault(frozenset(vars), []).append(allele)
 
     allele_reps = {} # allele representatives
     allele_rep_groups = {} # allele groups by allele representatives
@@ -115,47 +165,201 @@ def get_rep_alleles(Links, exon_vars, in_alleles = None):
     return allele_reps, allele_rep_groups
     
 
+""" '-'-joined sorted alleles; reads mostly repeat a few allele sets """
+@functools.lru_cache(maxsize = 4096)
+def get_cmpt_key(alleles):
+    return '-'.join(sorted(alleles))
+
+""" Add count statistics to given gene information """
+""" Returns the '-'-joined best-supported alleles of a read, or "" """
+def add_stat(Gene_cmpt, 
+             Gene_counts, 
+             Gene_count_per_read, 
+             include_alleles = set()):
+    if len(Gene_count_per_read) <= 0:
+        return ""
+    max_count = max(Gene_count_per_read.values())
+    cur_cmpt = set()
+    for allele, count in Gene_count_per_read.items():
+        if count < max_count:
+            continue
+        if len(include_alleles) > 0 \
+                and allele not in include_alleles:
+            continue
+        
+        cur_cmpt.add(allele)                    
+        if allele not in Gene_counts:
+            Gene_counts[allele] = 1
+        else:
+            Gene_counts[allele] += 1
+
+    if len(cur_cmpt) == 0:
+        return ""
+
+    cur_cmpt = get_cmpt_key(frozenset(cur_cmpt))
+    if not cur_cmpt in Gene_cmpt:
+        Gene_cmpt[cur_cmpt] = 1
+    else:
+        Gene_cmpt[cur_cmpt] += 1
+
+    return cur_cmpt
+
+""" Restrict each compatibility class to alleles, merging classes that coincide """
+def filter_cmpts(Gene_cmpt, alleles):
+    Gene_cmpt2 = {}
+    for cmpt, value in Gene_cmpt.items():
+        cmpt2 = alleles.intersection(cmpt.split('-'))
+        if len(cmpt2) == 0:
+            continue
+        cmpt2 = get_cmpt_key(frozenset(cmpt2))
+        if cmpt2 not in Gene_cmpt2:
+            Gene_cmpt2[cmpt2] = value
+        else:
+            Gene_cmpt2[cmpt2] += value
+    return Gene_cmpt2
+
+""" 
+Number of variants not shared between two position-sorted variant lists,
+   counted as compare_alleles does but without rebuilding the allele
+"""
+def count_mismatches(vars1, vars2, gene_vars):
+    if vars1 == vars2:
+        return 0
+    num_vars1  = len(vars1)
+    num_vars2  = len(vars2)
+    skip       = True
+    var_i      = 0
+    var_j      = 0
+    mismatches = 0
+    while var_i < num_vars1 and var_j < num_vars2:
+        cmp_var_id  = vars1[var_i]
+        node_var_id = vars2[var_j]
+        if cmp_var_id == node_var_id:
+            skip   = False
+            var_i += 1
+            var_j += 1
+            continue
+        cmp_type, cmp_pos, _ = gene_vars[cmp_var_id]
+        if cmp_pos <= gene_vars[node_var_id][1]:
+            if not skip:
+                if (var_i > 0 and var_i + 1 < num_vars1) \
+                        or cmp_type != "deletion":
+                    mismatches += 1
+            var_i += 1
+        else:
+            mismatches += 1
+            var_j += 1
+    return mismatches
+
+""" 
+Match and mismatch comparisons of read_seq, from read_pos, against 
+   ref_seq[left:right + 1] 
+"""
+def get_ungapped_cmps(ref_seq, read_seq, read_pos, left, right):
+    read_seg = read_seq[read_pos:read_pos + right - left + 1]
+    ref_seg  = ref_seq[left:right + 1]
+    # Both slices must cover [left, right]; a short one means a bad 
+    #   realignment, and would otherwise pass as an uncompared match
+    if left <= right \
+            and not len(read_seg) == len(ref_seg) == right - left + 1:
+        raise IndexError("segment [%d, %d] runs past the read or reference" 
+                          % (left, right))
+    # Most segments match outright; one C-level compare settles those
+    if read_seg == ref_seg:
+        return [["match", left, right - left + 1]] if left <= right else []
+
+    cmps = []
+    for pos, read_bp, ref_bp in zip(range(left, right + 1), 
+                                    read_seg, 
+                                    ref_seg):
+        if read_bp != ref_bp:
+            if left < pos:
+                cmps.append(["match", left, pos - left])
+            cmps.append(["mismatch", pos, 1, "unknown"])
+            left = pos + 1
+    if left <= right:
+        cmps.append(["match", left, right - left + 1])
+    return cmps
+
+""" 
+cmp_list with mismatches to unknown or novel variants folded into matches
+   Returned as is, without copying, when there is nothing to fold or merge
+"""
+def remove_unknown_mismatches(cmp_list):
+    prev_type = None
+    for cmp in cmp_list:
+        type = cmp[0]
+        if (type == "match" and prev_type == "match") \
+                or (type == "mismatch" 
+                        and (cmp[3] == "unknown" or cmp[3].startswith("nv"))):
+            break
+        prev_type = type
+    else:
+        return cmp_list
+
+    cmp_list2 = []
+    for cmp in cmp_list:
+        cmp = cmp[:] # flat list of strs and ints
+        type, pos, length = cmp[:3]
+        if type == "match":
+            if len(cmp_list2) > 0 and cmp_list2[-1][0] == "match":
+                cmp_list2[-1][2] += length
+            else:
+                cmp_list2.append(cmp)
+        elif type == "mismatch" and \
+             (cmp[3] == "unknown" or cmp[3].startswith("nv")):
+            if len(cmp_list2) > 0 and cmp_list2[-1][0] == "match":
+                cmp_list2[-1][2] += 1
+            else:
+                cmp_list2.append(["match", pos, 1])
+        else:
+            cmp_list2.append(cmp)
+    return cmp_list2
+
 """ Correction for sequencing Errors """
-def error_correct(ref_seq,
+""" 
+ref_bytes is the reference as bytes, and nt_sets[i] the bytes of 
+   representative bases at position i, so bases are compared as ints
+report_mismatch, if given, is called with (left, read_bp) for each
+   mismatch, and with (left, read_bp, cmp) after one is corrected
+"""
+def error_correct(ref_bytes,
                   read_seq,
                   read_pos,
-                  mpileup,
+                  nt_sets,
                   Vars,
                   Var_list,
                   cmp_list,
-                  debug = False):
-    if debug:
-        print(cmp_list, 
-              file=sys.stderr)
-        print(read_seq, 
-              file=sys.stderr)
-
+                  report_mismatch = None):
+    # Mutable copy of the read so corrections do not rebuild the string
+    read_buf = bytearray(read_seq, "ascii")
+    N = ord('N')
     num_correction = 0
-    i = 0
-    while i < len(cmp_list):
-        type, left, length = cmp_list[i][:3]
+    new_cmp_list   = []
+    for i, cmp in enumerate(cmp_list):
+        type, left, length = cmp[:3]
         assert length > 0
-        if left >= len(ref_seq):
+        if left >= len(ref_bytes):
+            new_cmp_list += cmp_list[i:]
             break
         if type == "match":
             middle_cmp_list = []
             last_j = 0
             for j in range(length):
-                if read_pos + j >= len(read_seq) or left + j >= len(ref_seq):
+                if read_pos + j >= len(read_buf) or left + j >= len(ref_bytes):
                     continue
                 
-                read_bp, ref_bp = read_seq[read_pos + j], ref_seq[left + j]
-                assert left + j < len(mpileup)
-                nt_set = mpileup[left + j][0]
-                if len(nt_set) > 0 and read_bp not in nt_set:
-                    read_bp = 'N' if len(nt_set) > 1 else nt_set[0]                    
-                    read_seq = read_seq[:read_pos + j] \
-                                + read_bp \
-                                + read_seq[read_pos + j + 1:]
-                    assert read_bp != ref_bp
+                read_bp = read_buf[read_pos + j]
+                assert left + j < len(nt_sets)
+                nt_set = nt_sets[left + j]
+                if nt_set and read_bp not in nt_set:
+                    read_bp = N if len(nt_set) > 1 else nt_set[0]                    
+                    read_buf[read_pos + j] = read_bp
+                    assert read_bp != ref_bytes[left + j]
                     new_cmp = ["mismatch", left + j, 1, "unknown"]
                     num_correction += 1
-                    if read_bp != 'N':
+                    if read_bp != N:
+                        read_bp = chr(read_bp)
                         var_idx = typing_common.lower_bound(Var_list, left + j)
                         while var_idx < len(Var_list):
                             var_pos, var_id = Var_list[var_idx]
@@ -179,28 +383,25 @@ def error_correct(ref_seq,
                                         length - last_j])
 
             assert len(middle_cmp_list) > 0
-            cmp_list = cmp_list[:i] + middle_cmp_list + cmp_list[i+1:]
-            i += (len(middle_cmp_list) - 1)
+            new_cmp_list += middle_cmp_list
         else:
             assert type == "mismatch"
-            read_bp, ref_bp = read_seq[read_pos], ref_seq[left]
-            assert left < len(mpileup)
-            nt_set = mpileup[left][0]
-
-            if debug:
-                print((left, read_bp, ref_bp, mpileup[left]), 
-                      file=sys.stderr)
-
-            if len(nt_set) > 0 and read_bp not in nt_set:
-                read_bp = 'N' if len(nt_set) > 1 else nt_set[0]
-                read_seq = read_seq[:read_pos] + read_bp + read_seq[read_pos+1:]
-                if read_bp == 'N':
-                    cmp_list[i][3] = "unknown"
-                elif read_bp == ref_bp:
-                    cmp_list[i] = ["match", left, 1]
+            read_bp = read_buf[read_pos]
+            assert left < len(nt_sets)
+            nt_set = nt_sets[left]
+            if report_mismatch is not None:
+                report_mismatch(left, read_bp)
+            if nt_set and read_bp not in nt_set:
+                read_bp = N if len(nt_set) > 1 else nt_set[0]
+                read_buf[read_pos] = read_bp
+                if read_bp == N:
+                    cmp[3] = "unknown"
+                elif read_bp == ref_bytes[left]:
+                    cmp = ["match", left, 1]
                     num_correction += 1
                 else:
-                    cmp_list[i][3] = "unknown"
+                    cmp[3] = "unknown"
+                    read_bp = chr(read_bp)
                     var_idx = typing_common.lower_bound(Var_list, left)
                     while var_idx < len(Var_list):
                         var_pos, var_id = Var_list[var_idx]
@@ -209,42 +410,126 @@ def error_correct(ref_seq,
                         if var_pos == left:
                             var_type, _, var_data = Vars[var_id]
                             if var_type == "single" and read_bp == var_data:
-                                cmp_list[i][3] = var_id
+                                cmp[3] = var_id
                                 break                                                        
                         var_idx += 1
-
-                if debug:
-                    print((left, read_bp, ref_bp, mpileup[left]), 
-                          file=sys.stderr)
-                    print(cmp_list[i], 
-                          file=sys.stderr)
+                if report_mismatch is not None:
+                    report_mismatch(left, read_bp, cmp)
+            new_cmp_list.append(cmp)
 
         read_pos += length
-        i += 1
 
     # Combine matches
-    i = 0
-    while i < len(cmp_list):
-        type, left, length = cmp_list[i][:3]
-        if type == "match" and i + 1 < len(cmp_list):
-            type2, left2, length2 = cmp_list[i+1][:3]
-            if type2 == "match":
-                cmp_list[i] = [type, left, length + length2]
-                cmp_list = cmp_list[:i+1] + cmp_list[i+2:]
-                continue
-        i += 1
+    cmp_list = []
+    for cmp in new_cmp_list:
+        if cmp[0] == "match" and len(cmp_list) > 0 and cmp_list[-1][0] == "match":
+            _, left, length = cmp_list[-1]
+            cmp_list[-1] = ["match", left, length + cmp[2]]
+        else:
+            cmp_list.append(cmp)
 
-    if debug:
-        print(cmp_list, 
-              file=sys.stderr)
-        print(read_seq, 
+    read_seq = read_buf.decode("ascii")
+    return cmp_list, read_seq, num_correction
+
+""" error_correct that also dumps the read, each mismatch with its pileup """
+""" entry before and after correction, and the result """
+def error_correct_debug(ref_bytes,
+                        read_seq,
+                        read_pos,
+                        nt_sets,
+                        Vars,
+                        Var_list,
+                        cmp_list,
+                        mpileup):
+    def report_mismatch(left, read_bp, cmp = None):
+        if isinstance(read_bp, int):
+            read_bp = chr(read_bp)
+        print((left, read_bp, chr(ref_bytes[left]), mpileup[left]), 
               file=sys.stderr)
-                            
+        if cmp is not None:
+            print(cmp, 
+                  file=sys.stderr)
+
+    print(cmp_list, 
+          file=sys.stderr)
+    print(read_seq, 
+          file=sys.stderr)
+    cmp_list, read_seq, num_correction = error_correct(ref_bytes,
+                                                       read_seq,
+                                                       read_pos,
+                                                       nt_sets,
+                                                       Vars,
+                                                       Var_list,
+                                                       cmp_list,
+                                                       report_mismatch)
+    print(cmp_list, 
+          file=sys.stderr)
+    print(read_seq, 
+          file=sys.stderr)
     return cmp_list, read_seq, num_correction
 
+# --------------------------------------------------------------------------- #
+# Functions for parsing alignments                                            #
+# --------------------------------------------------------------------------- #
+""" 
+CIGAR string to ((op, length), ...), e.g. "10S140M" -> (('S', 10), ('M', 140))
+   Cached since a handful of CIGAR strings make up most alignments
+"""
+@functools.lru_cache(maxsize = 4096)
+def parse_cigar(cigar_str):
+    cigars, num = [], 0
+    for c in cigar_str.encode("ascii"):
+        if 48 <= c <= 57: # '0' - '9'
+            num = num * 10 + c - 48
+        else:
+            cigars.append((chr(c), num))
+            num = 0
+    return tuple(cigars)
+
+""" 
+MD string to tokens: ints for matched runs, the reference base of a 
+   mismatch, or '^' plus the deleted bases, e.g. "5A0^CT10" -> 
+   (5, 'A', 0, '^CT', 10)
+"""
+_IS_ACGT = bytes(1 if chr(c) in "ACGT" else 0 for c in range(256))
+@functools.lru_cache(maxsize = 4096)
+def parse_MD(MD):
+    MD_b = MD.encode("ascii")
+    tokens, num, i = [], None, 0
+    while i < len(MD_b):
+        c = MD_b[i]
+        if 48 <= c <= 57: # '0' - '9'
+            num = (num or 0) * 10 + c - 48
+            i += 1
+            continue
+        if num is not None:
+            tokens.append(num)
+            num = None
+        if c == 94: # '^'
+            j = i + 1
+            while j < len(MD_b) and _IS_ACGT[MD_b[j]]:
+                j += 1
+            tokens.append(MD[i:j])
+            i = j
+        else:
+            tokens.append(MD[i])
+            i += 1
+    if num is not None:
+        tokens.append(num)
+    return tuple(tokens)
+
 # --------------------------------------------------------------------------- #
 # Main function for typing used by genotype function                          #
 # --------------------------------------------------------------------------- #
+""" Install the per-locus function in forked workers; it is inherited, 
+    not pickled, so it may be a closure over typing()'s tables """
+def init_locus_worker(locus_worker):
+    global type_locus_worker
+    type_locus_worker = locus_worker
+
+def run_locus_worker(test_Gene_names):
+    return type_locus_worker(test_Gene_names)
+
 """ This script has many argument. Consider making a class or namespace """
 def typing(simulation,
            full_path_base_fname,
@@ -288,10 +573,9 @@ def typing(simulation,
     complete    = {"Init Align"    : False,
                    "Locus Process" : False,
                    "Align Return"  : False} # list of completed tasks
-    print("got here a", file=sys.stderr);
     base_fname  = full_path_base_fname.split("/")[-1]
     core_fid    = "" # May add to bottom of options
-    report_base = '%s/%s-%s.' % (out_dir, output_base, base_fname)
+    report_base = f'{out_dir}/{output_base}-{base_fname}.'
     if simulation:
         test_passed  = {}
         core_fid     = str(test_i + 1)
@@ -300,7 +584,8 @@ def typing(simulation,
         core_fid = '_'.join(read_fname[0].split('/')[-1].split('.')[:-1])
 
     report_base += core_fid
-    report_file  = open('%s.report' % report_base, "w")
+    # Report lines are collected in memory and written out once at the end
+    report_file  = io.StringIO()
 
     if verbose or assembly_verbose or simulation:
         msg_out = [sys.stderr, report_file]
@@ -313,16 +598,13 @@ def typing(simulation,
     h2_version  = open(version_dir + '/hisat2/VERSION', 'r').read()
     cmd_call    = ' '.join(sys.argv)
 
+    header_str  = '\n'.join(["# VERSIONS:",
+                              "# HISAT2 - %s" % h2_version,
+                              "# HISAT-genotype - %s" % hg_version,
+                              "# Database - %s" % dbversion,
+                              "# COMMAND:\n%s" % cmd_call])
     for f_ in msg_out:
-        print("# VERSIONS:", 
-              file=f_)
-        print("# HISAT2 - %s" % h2_version, 
-              file=f_)
-        print("# HISAT-genotype - %s" % hg_version, 
-              file=f_)
-        print("# Database - %s" % dbversion, 
-              file=f_)
-        print("# COMMAND:\n%s" % cmd_call, 
+        print(header_str, 
               file=f_)
         # if base_fname == "genome":
         #     print("\t" + locus_list, 
@@ -348,9 +630,9 @@ def typing(simulation,
             # Align reads, and sort the alignments into a BAM file
             remove_alignment_file = True
             if simulation:
-                alignment_fname = "%s_output.bam" % base_fname
+                alignment_fname = f"{base_fname}_output.bam"
             else:
-                alignment_fname = "%s.bam" % core_fid
+                alignment_fname = f"{core_fid}.bam"
 
             if genotype_genome != "":
                 gegenome = genotype_genome
@@ -367,15 +649,25 @@ def typing(simulation,
                                       alignment_fname,
                                       verbose)
 
+        # (Re)index only when the index is missing or older than the BAM
+        index_fname = alignment_fname + ".bai"
+        if not os.path.exists(index_fname) \
+                or os.path.getmtime(index_fname) < os.path.getmtime(alignment_fname):
+            subprocess.run(["samtools", "index", alignment_fname], check = True)
+
         viterbi_calls = {}
-        for test_Gene_names in locus_list:
+        """ Types one locus; returns False if its assembly failed """
+        def type_locus(test_Gene_names, msg_out):
+            # An assembly failure is kept to this locus so serial and 
+            #   pooled runs report the same loci
+            locus_assembly = assembly
             complete["Locus Process"] = True # Begin locus processing
             if base_fname == "genome":
                 if simulation:
                     region_chr, region_left, region_right = test_Gene_names[0]
                 else:
                     region_chr, region_left, region_right = test_Gene_names
-                gene = "%s:%d-%d" % (region_chr, region_left, region_right)
+                gene = f"{region_chr}:{region_left}-{region_right}"
             else:
                 if simulation:
                     gene = test_Gene_names[0].split('*')[0]
@@ -385,30 +677,40 @@ def typing(simulation,
             viterbi_calls[gene] = []
             ref_allele          = refGenes[gene]
             ref_seq             = Genes[gene][ref_allele]
+            ref_bytes           = ref_seq.encode("ascii")
             ref_locus           = refGene_loci[gene]
             ref_exons           = ref_locus[-2]
             ref_primary_exons   = ref_locus[-1]
+            ref_exon_tree       = IITree(ref_exons)
+            ref_primary_exon_tree = IITree(ref_primary_exons)
             novel_var_count     = 0        
-            gene_vars           = deepcopy(Vars[gene])
-            gene_var_list       = deepcopy(Var_list[gene])
-            cur_maxright        = -1
-            gene_var_maxrights  = {}
-
-            for var_pos, var_id in gene_var_list:
-                var_type, var_pos, var_data = gene_vars[var_id]
+            # Shallow per-entry copies; entries only hold strs and ints
+            gene_vars           = {var_id: var[:] 
+                                    for var_id, var in Vars[gene].items()}
+            gene_var_list       = [var[:] for var in Var_list[gene]]
+            # Sorted variant positions for bisecting gene_var_list,
+            #   kept in step with gene_var_list as novel variants are added
+            gene_var_positions  = [var_pos for var_pos, _ in gene_var_list]
+            # (var_id, type, data, length) by list index, also kept in step,
+            #   so the alignment parser matches variants without dict lookups
+            def make_var_record(var_id):
+                var_type, _, var_data = gene_vars[var_id]
                 if var_type == "deletion":
-                    var_pos = var_pos + int(var_data) - 1
-                cur_maxright = max(cur_maxright, var_pos)
-                gene_var_maxrights[var_id] = cur_maxright
-                    
+                    var_len = int(var_data)
+                else:
+                    var_len = len(var_data)
+                return var_id, var_type, var_data, var_len
+            gene_var_records    = [make_var_record(var_id) 
+                                    for _, var_id in gene_var_list]
+            # Running max of right ends, by list index
+            gene_var_maxrights  = list(itertools.accumulate(
+                                    (get_var_right(gene_vars[var_id]) 
+                                        for _, var_id in gene_var_list), 
+                                    max))
+
             var_count = {}
-            def add_novel_var(gene_vars,
-                              gene_var_list,
-                              novel_var_count,
-                              var_type,
-                              var_pos,
-                              var_data):
-                var_idx = typing_common.lower_bound(gene_var_list, var_pos)
+            def find_novel_var_index(var_type, var_pos, var_data):
+                var_idx = bisect.bisect_left(gene_var_positions, var_pos)
                 while var_idx < len(gene_var_list):
                     pos_, id_ = gene_var_list[var_idx]
                     if pos_ > var_pos:
@@ -425,23 +727,45 @@ def typing(simulation,
                             if var_data < data_:
                                 break
                     var_idx += 1
-                var_id = "nv%d" % novel_var_count
-                assert var_id not in gene_vars
-                gene_vars[var_id] = [var_type, var_pos, var_data]
-                gene_var_list.insert(var_idx, [var_pos, var_id])                
-                return var_id, novel_var_count + 1
-
-            print("got here 1", file=sys.stderr)
-            if not os.path.exists(alignment_fname + ".bai"):
-                os.system("samtools index %s" % alignment_fname)
-            print("got here 2", file=sys.stderr)
+                return var_idx
+
+            # Register a read's novel variants, [[type, pos, data], ...] in read
+            #   order, together. Slots are found against the current list and
+            #   filled back to front so earlier slots stay valid; within a
+            #   read, variants sharing a pos (I then M, I then D) already come
+            #   in the order the slot search would place them one at a time.
+            def add_novel_vars(gene_vars,
+                               gene_var_list,
+                               novel_var_count,
+                               novel_vars):
+                var_ids, var_slots = [], []
+                for novel_i, (var_type, var_pos, var_data) in enumerate(novel_vars):
+                    var_id = sys.intern(f"nv{novel_var_count + novel_i}")
+                    assert var_id not in gene_vars
+                    var_ids.append(var_id)
+                    var_slots.append((find_novel_var_index(var_type, 
+                                                           var_pos, 
+                                                           var_data), 
+                                      novel_i))
+                for var_idx, novel_i in sorted(var_slots, reverse = True):
+                    var_id = var_ids[novel_i]
+                    var_type, var_pos, var_data = novel_vars[novel_i]
+                    gene_vars[var_id] = [var_type, var_pos, var_data]
+                    gene_var_list.insert(var_idx, [var_pos, var_id])
+                    gene_var_positions.insert(var_idx, var_pos)
+                    gene_var_records.insert(var_idx, make_var_record(var_id))
+                    # Novel variants do not extend the max right of known variants
+                    gene_var_maxrights.insert(var_idx, 
+                                              gene_var_maxrights[var_idx - 1] 
+                                                if var_idx > 0 else -1)
+                return var_ids, novel_var_count + len(novel_vars)
+
             # Read alignments
             alignview_cmd = ["samtools", "view", alignment_fname]
             base_locus = 0
-            alignview_proc: subprocess.Popen[str] = ""
             if genotype_genome != "":
                 _, chr, left, right = ref_locus[:4]
-                alignview_cmd += ["%s:%d-%d" % (chr, left+1, right+1)]
+                alignview_cmd += [f"{chr}:{left+1}-{right+1}"]
                 base_locus = left
 
             if index_type == "graph":
@@ -451,6 +775,17 @@ def typing(simulation,
                                                     base_locus,
                                                     gene_vars,
                                                     allow_discordant)
+                # Representative bases by position, e.g. b"" or b"A" or b"CT"
+                mpileup_nt_sets = [''.join(nt_set).encode("ascii") 
+                                     for nt_set, _ in mpileup]
+                # Positions where a deletion is outnumbered 6:1 by bases;
+                #   only the HLA deletion check below reads it
+                mpileup_weak_dels = []
+                if base_fname == "hla":
+                    for _, nt_dic in mpileup:
+                        del_count = nt_dic['D'][0] if 'D' in nt_dic else 0
+                        nt_count  = sum(value[0] for value in nt_dic.values()) - del_count
+                        mpileup_weak_dels.append(del_count * 6 < nt_count)
 
                 if base_fname == "codis":
                     pair_interdist = typing_common.get_pair_interdist(alignview_cmd,
@@ -459,30 +794,25 @@ def typing(simulation,
                 else:
                     pair_interdist = None
 
-                print("1----------------{}------------- module".format(alignview_cmd), file=sys.stderr)
                 bamview_proc = subprocess.Popen(alignview_cmd,
                                                 universal_newlines = True,
                                                 stdout = subprocess.PIPE,
-                                                stderr = open("/dev/null", 'w'))
-                for line in bamview_proc.stdout.read():
-                    print("a----{}----".format(line)) 
-                bamview_proc.stdout.seek(0)
-                print("2----------------{}------------- module".format(bamview_proc.stdout), file=sys.stderr)
+                                                stderr = subprocess.DEVNULL)
                 sort_read_cmd = ["sort", "-k", "1,1", "-s"] # -s for stable sorting
                 alignview_proc = subprocess.Popen(sort_read_cmd,
                                                   universal_newlines = True,
+                                                  bufsize = 1 << 20,
                                                   stdin  = bamview_proc.stdout,
                                                   stdout = subprocess.PIPE,
-                                                  stderr = open("/dev/null", 'w'))
+                                                  stderr = subprocess.DEVNULL)
+                bamview_proc.stdout.close() # sort now owns the pipe
             else:
                 alignview_proc = subprocess.Popen(alignview_cmd,
                                                   universal_newlines = True,
+                                                  bufsize = 1 << 20,
                                                   stdout = subprocess.PIPE,
-                                                  stderr = open("/dev/null", 'w'))
+                                                  stderr = subprocess.DEVNULL)
 
-            outs, errs = alignview_proc.communicate()
-            alignview_proc_str = outs
-            print("3--{}--".format(alignview_proc_str))
             # List of nodes that represent alleles
             allele_vars = {}
             for _, var_id in gene_var_list:
@@ -498,11 +828,16 @@ def typing(simulation,
                         allele_vars[allele_id].append(var_id)
 
             # Extract variants that are within exons
-            exon_vars = get_exonic_vars(gene_vars, ref_exons)
-            primary_exon_vars = get_exonic_vars(gene_vars, ref_primary_exons)
+            exon_vars = get_exonic_vars(gene_vars, ref_exon_tree)
+            primary_exon_vars = get_exonic_vars(gene_vars, 
+                                                ref_primary_exon_tree)
 
             # Store de bruijn nodes that represent alleles
             allele_nodes = {}
+            # Node only reads qual and var, so every allele shares the blank
+            #   quality string and alleles without variants share ref_var
+            allele_qual = ' ' * len(ref_seq)
+            ref_var     = [""] * len(ref_seq)
             def create_allele_node(allele_name):
                 if allele_name in allele_nodes:
                     return allele_nodes[allele_name]
@@ -510,31 +845,30 @@ def typing(simulation,
                     var_ids = allele_vars[allele_name]
                 else:
                     var_ids = []
-                seq = list(ref_seq)  # sequence that node represents
+                seq = bytearray(ref_bytes)  # sequence that node represents
 
                 # how sequence is related to backbone
-                var = ["" for i in range(len(ref_seq))]  
+                var = ref_var[:] if var_ids else ref_var
                 for var_id in var_ids:
                     assert var_id in gene_vars
                     var_type, var_pos, var_data = gene_vars[var_id]
                     assert var_pos >= 0 and var_pos < len(ref_seq)
                     if var_type == "single":
-                        seq[var_pos] = var_data
+                        seq[var_pos] = ord(var_data)
                         var[var_pos] = var_id
                     elif var_type == "deletion":
                         del_len = int(var_data)
                         assert var_pos + del_len <= len(ref_seq)
-                        seq[var_pos:var_pos + del_len] = ['D'] * del_len
+                        seq[var_pos:var_pos + del_len] = b'D' * del_len
                         var[var_pos:var_pos + del_len] = [var_id] * del_len
                     else:
                         # DK - to be implemented for insertions
                         assert var_type == "insertion"
 
-                qual = ' ' * len(seq)
                 allele_node = assembly_graph.Node(allele_name,
                                                   0,
                                                   seq,
-                                                  qual,
+                                                  allele_qual,
                                                   var,
                                                   ref_seq,
                                                   gene_vars,
@@ -584,6 +918,19 @@ def typing(simulation,
                 validation_check.check_repset_inclusion(allele_rep_set,
                                                         allele_reps,
                                                         primary_exon_allele_reps)
+
+            # Alleles that per-read counts are kept for 
+            #   (no backbones, nor the reference genome for genome typing)
+            count_alleles = [allele for allele in Gene_names[gene]
+                                if allele.find("BACKBONE") == -1
+                                   and not (base_fname == "genome" 
+                                            and allele.find("GRCh38") != -1)]
+            primary_exon_count_alleles \
+                = [allele for allele in count_alleles
+                     if allele in primary_exon_allele_rep_set]
+            exon_count_alleles \
+                = [allele for allele in count_alleles
+                     if allele in allele_rep_set]
                                     
             # For checking alternative alignments near the ends of alignments
             Alts_left, Alts_right = typing_common.get_alternatives(ref_seq,
@@ -618,74 +965,108 @@ def typing(simulation,
 
             # For debugging purposes
             if simulation and verbose >= 2:
-                debug_allele_names = set(test_Gene_names)
+                debug_allele_names = frozenset(test_Gene_names)
             else:
-                debug_allele_names = set()
+                debug_allele_names = frozenset()
+            # Report pairs whose best alleles miss the simulated ones
+            debug_pairs = simulation \
+                            and verbose >= 2 \
+                            and base_fname in ["hla", "codis"]
+            if debug_pairs:
+                debug_Gene_names = '-'.join(test_Gene_names)
 
             # Read information
             prev_read_id    = None
             prev_right_pos  = 0
             prev_lines      = []
-            left_read_ids   = set()
-            right_read_ids  = set()
-            single_read_ids = set()
+            seen_read_ids   = {} # read_id -> mask of mates seen (1: L, 2: R, 4: U)
             if index_type == "graph":
                 # nodes for reads
                 read_nodes = []
 
+                # Alleles as bits of an int so that allele sets can be
+                #   intersected with bitwise operations
+                gene_allele_names = list(Genes[gene].keys())
+                gene_allele_index = {allele : i 
+                                        for i, allele in enumerate(gene_allele_names)}
+                gene_allele_mask  = (1 << len(gene_allele_names)) - 1
+                if ref_allele in gene_allele_index:
+                    gene_allele_mask &= ~(1 << gene_allele_index[ref_allele])
+
+                # Alleles each per-read count dict is kept for, as masks
+                def items_to_mask(alleles):
+                    mask = 0
+                    for allele in alleles:
+                        if allele in gene_allele_index:
+                            mask |= 1 << gene_allele_index[allele]
+                    return mask
+                count_mask              = items_to_mask(count_alleles)
+                exon_count_mask         = items_to_mask(exon_count_alleles)
+                primary_exon_count_mask = items_to_mask(primary_exon_count_alleles)
+
+                # Alleles linked to each variant, built on first use
+                #   None for novel variants and variants without links
+                gene_link_masks = {}
+                def get_link_mask(var_id):
+                    if var_id in gene_link_masks:
+                        return gene_link_masks[var_id]
+                    link_mask = None
+                    if not var_id.startswith("nv") and var_id in Links:
+                        link_mask = 0
+                        for allele in Links[var_id]:
+                            if allele in gene_allele_index:
+                                link_mask |= 1 << gene_allele_index[allele]
+                    gene_link_masks[var_id] = link_mask
+                    return link_mask
+
                 # Get number of alleles read aligns to
-                def add_count(count_per_read, ht, add):
+                def add_count(count_per_read, count_mask, ht, add):
                     if base_fname == "genome" and len(count_per_read) == 1:
                         for allele in count_per_read.keys():
                             count_per_read[allele] = add
                         return
                     
-                    orig_ht = ht
-                    ht = ht.split('-')
-
                     assert len(ht) >= 2
-                    left  = int(ht[0])
-                    right = int(ht[-1])
+                    left  = ht[0]
+                    right = ht[-1]
                     assert left <= right
 
                     ht = ht[1:-1]
-                    alleles = set(Genes[gene].keys()) - set([ref_allele])
+                    alleles = gene_allele_mask
                     for i in range(len(ht)):
-                        var_id = ht[i]
-                        if var_id.startswith("nv") or \
-                           var_id not in Links:
+                        link_mask = get_link_mask(ht[i])
+                        if link_mask is None:
                             continue
-                        alleles &= set(Links[var_id])
+                        alleles &= link_mask
                     ht = set(ht)
 
-                    tmp_alleles = set()
-                    var_idx = typing_common.lower_bound(gene_var_list, right + 1)
+                    tmp_alleles = 0
+                    var_idx = bisect.bisect_left(gene_var_positions, right + 1)
                     var_idx = min(var_idx, len(gene_var_list) - 1)
-                    while var_idx >= 0:
+                    # Variants below min_idx all end before left
+                    min_idx = bisect.bisect_left(gene_var_maxrights, left)
+                    while var_idx >= min_idx:
                         _, var_id = gene_var_list[var_idx]
-                        if var_id.startswith("nv") \
-                                or var_id in ht \
-                                or var_id not in Links:
+                        link_mask = get_link_mask(var_id)
+                        if link_mask is None or var_id in ht:
                             var_idx -= 1
                             continue
-                        if var_id in gene_var_maxrights \
-                                and gene_var_maxrights[var_id] < left:
-                            break
                         var_type, var_left, var_data = gene_vars[var_id]
                         var_right = var_left
                         if var_type == "deletion":
                             var_right = var_left + int(var_data) - 1
                         if (var_left >= left and var_left <= right) \
                                 or (var_right >= left and var_right <= right):
-                            tmp_alleles |= set(Links[var_id])
+                            tmp_alleles |= link_mask
                         var_idx -= 1                        
-                    alleles -= tmp_alleles
-                    alleles &= set(count_per_read.keys())
+                    alleles &= ~tmp_alleles & count_mask
                     
-                    for allele in alleles:
+                    num_alleles = 0
+                    for allele in mask_to_items(alleles, gene_allele_names):
                         count_per_read[allele] += add
+                        num_alleles += 1
 
-                    return len(alleles)
+                    return num_alleles
 
                 # Identify best pairs
                 def choose_pairs(left_positive_hts, right_positive_hts):
@@ -695,45 +1076,45 @@ def typing(simulation,
                                     len(right_positive_hts)) >= 2:
                         expected_inter_dist = pair_interdist
                             
-                        best_diff = sys.maxsize
-                        picked = []                                
-                        for left_ht_str in left_positive_hts:
-                            left_ht = left_ht_str.split('-')
-                            l_left, l_right = int(left_ht[0]), int(left_ht[-1])
-                            for right_ht_str in right_positive_hts:
-                                right_ht = right_ht_str.split('-')
-                                r_left  = int(right_ht[0])
-                                r_right = int(right_ht[-1])
+                        pair_diffs = []
+                        for left_ht in left_positive_hts:
+                            l_left, l_right = left_ht[0], left_ht[-1]
+                            for right_ht in right_positive_hts:
+                                r_left, r_right = right_ht[0], right_ht[-1]
                                 if l_right < r_right:
                                     inter_dist = r_left - l_right - 1
                                 else:
                                     inter_dist = l_left - r_right - 1
-
-                                cur_diff = abs(expected_inter_dist - inter_dist)
-                                if best_diff > cur_diff:
-                                    best_diff = cur_diff
-                                    picked = [[left_ht_str, right_ht_str]]
-                                elif best_diff == cur_diff:
-                                    picked.append([left_ht_str, right_ht_str])
-
-                        assert len(picked) > 0
-
-                        left_positive_hts  = set()
-                        right_positive_hts = set()
-                        for left_ht_str, right_ht_str in picked:
-                            left_positive_hts.add(left_ht_str)
-                            right_positive_hts.add(right_ht_str)
+                                pair_diffs.append((abs(expected_inter_dist - inter_dist),
+                                                   left_ht, 
+                                                   right_ht))
+
+                        best_diff = min(pair_diffs, key = lambda x: x[0])[0]
+                        left_positive_hts  = set(left_ht 
+                                                 for cur_diff, left_ht, _ in pair_diffs
+                                                   if cur_diff == best_diff)
+                        right_positive_hts = set(right_ht 
+                                                 for cur_diff, _, right_ht in pair_diffs
+                                                   if cur_diff == best_diff)
 
                     return left_positive_hts, right_positive_hts
 
+                # Haplotypes recur across reads, and a variant's coordinates
+                #   never change once added, so results are kept per locus
+                #   One table per exon list (primary exons, all exons)
+                exon_hts_caches = {} # id(exons) -> {ht: exon haplotypes}
                 def get_exon_haplotypes(ht, exons):
                     if len(exons) <= 0:
                         return []
                     
-                    debug_ht = deepcopy(ht)
-                    ht = ht.split('-')
+                    exon_hts_cache = exon_hts_caches.get(id(exons))
+                    if exon_hts_cache is None:
+                        exon_hts_cache = exon_hts_caches[id(exons)] = {}
+                    exon_hts = exon_hts_cache.get(ht)
+                    if exon_hts is not None:
+                        return exon_hts
+
                     assert len(ht) >= 2
-                    ht[0], ht[-1] = int(ht[0]), int(ht[-1])
                     exon_hts = []
                     for e_left, e_right in exons:
                         assert len(ht) >= 2
@@ -741,7 +1122,7 @@ def typing(simulation,
                         if e_left > ht_right or e_right < ht_left:
                             continue
 
-                        new_ht = deepcopy(ht)
+                        new_ht = ht # only ever rebound below, never mutated
                         if ht_left < e_left:
                             split = False
                             for i in range(1, len(new_ht) - 1):
@@ -751,19 +1132,19 @@ def typing(simulation,
                                         or (type == "deletion" 
                                                 and left - 1 >= e_left):
                                     ht_left = e_left
-                                    new_ht = [ht_left] + new_ht[i:]
+                                    new_ht = (ht_left,) + new_ht[i:]
                                     split = True
                                     break
                                 if type == "deletion":
                                     right = left + int(data)
                                     if right >= e_left:
                                         ht_left = right
-                                        new_ht = [right] + new_ht[i+1:]
+                                        new_ht = (right,) + new_ht[i+1:]
                                         split = True
                                         break
                             if not split:
                                 ht_left = e_left
-                                new_ht = [ht_left, ht_right]
+                                new_ht = (ht_left, ht_right)
                         assert ht_left >= e_left
                         if ht_right > e_right:
                             split = False
@@ -776,43 +1157,36 @@ def typing(simulation,
                                         or (type == "deletion" 
                                                 and right + 1 <= e_right):
                                     ht_right = e_right
-                                    new_ht = new_ht[:i+1] + [ht_right]
+                                    new_ht = new_ht[:i+1] + (ht_right,)
                                     split = True
                                     break
                                 if type == "deletion":
                                     left = right - int(data)
                                     if left <= e_right:
                                         ht_right = left
-                                        new_ht = new_ht[:i] + [ht_right]
+                                        new_ht = new_ht[:i] + (ht_right,)
                                         split = True
                                         break
                             if not split:
                                 ht_right = e_right
-                                new_ht = [ht_left, ht_right]
+                                new_ht = (ht_left, ht_right)
 
-                        if len(new_ht) == 2:
-                            new_ht = "%d-%d" % (new_ht[0], new_ht[-1])
-                        else:
-                            assert len(new_ht) > 2
-                            new_ht = "%d-%s-%d" % (new_ht[0], 
-                                                   '-'.join(new_ht[1:-1]), 
-                                                   new_ht[-1])
                         assert ht_left <= ht_right
                         exon_hts.append(new_ht)
 
+                    exon_hts_cache[ht] = exon_hts
                     return exon_hts
 
                 # Positive evidence for left and right reads
                 left_positive_hts  = set()
                 right_positive_hts = set()
                 
-                # Cigar regular expression
-                cigar_re = re.compile('\d+\w')
-                for line in alignview_proc_str:
+                # Alignments are consumed line by line as they are produced
+                for line in alignview_proc.stdout:
                     if not complete["Align Return"]: # Confirm alingment return
                         complete["Align Return"] = True
-                    line = line.strip()
-                    cols = line.split()
+                    line = line.rstrip('\n')
+                    cols = line.split('\t') # SAM fields are tab-separated
                     read_id, flag, chr, pos, mapQ, cigar_str = cols[:6]
 
                     node_read_id = orig_read_id = read_id
@@ -839,17 +1213,22 @@ def typing(simulation,
                     else:
                         concordant = False
 
+                    # Optional fields are TAG:TYPE:VALUE, so dispatch on the tag
                     NM, Zs, MD, NH = "", "", "", ""
-                    for i in range(11, len(cols)):
-                        col = cols[i]
-                        if col.startswith("Zs"):
+                    for col in cols[11:]:
+                        tag = col[:2]
+                        if tag == "Zs":
                             Zs = col[5:]
-                        elif col.startswith("MD"):
+                        elif tag == "MD":
                             MD = col[5:]
-                        elif col.startswith("NM"):
+                        elif tag == "NM":
                             NM = int(col[5:])
-                        elif col.startswith("NH"):
+                        elif tag == "NH":
                             NH = int(col[5:])
+                        else:
+                            continue
+                        if NM != "" and Zs != "" and MD != "" and NH != "":
+                            break
 
                     if NM > num_editdist:
                         continue
@@ -865,44 +1244,44 @@ def typing(simulation,
                     # Add reads to nodes and assign left, right, or discordant
                     is_left_read = flag & 0x40 != 0
                     if is_left_read:            # Left read?
-                        if read_id in left_read_ids:
-                            continue
-                        left_read_ids.add(read_id)
-                        if not simulation:
-                            node_read_id += '|L'
+                        mate_mask, mate_tag = 1, '|L'
                     elif flag & 0x80 != 0:      # Right read?
-                        if read_id in right_read_ids:
-                            continue
-                        right_read_ids.add(read_id)
-                        if not simulation:
-                            node_read_id += '|R'
+                        mate_mask, mate_tag = 2, '|R'
                     else:
                         assert allow_discordant
-                        if read_id in single_read_ids:
-                            continue
-                        single_read_ids.add(read_id)
-                        if not simulation:
-                            node_read_id += '|U'
+                        mate_mask, mate_tag = 4, '|U'
+                    seen_mask = seen_read_ids.get(read_id, 0)
+                    if seen_mask & mate_mask:
+                        continue
+                    seen_read_ids[read_id] = seen_mask | mate_mask
+                    if not simulation:
+                        node_read_id += mate_tag
+
+                    # Alignments running past the backbone are dropped, so test
+                    #   that from the CIGAR alone before walking the MD and Zs
+                    cigars = parse_cigar(cigar_str)
+                    if pos + sum(length for cigar_op, length in cigars 
+                                   if cigar_op in "MND") > len(ref_seq):
+                        continue
 
+                    # Zs:Z:offset|type|var_id,... -> [(offset, type, var_id), ...]
                     if Zs:
-                        Zs_str = Zs
-                        Zs     = Zs.split(',')             
+                        Zs = [(int(Zs_offset), Zs_type, sys.intern(Zs_var_id))
+                                for Zs_offset, Zs_type, Zs_var_id 
+                                  in (Zs_tok.split('|', 2) 
+                                        for Zs_tok in Zs.split(','))]
 
                     assert MD != ""
-                    MD_str_pos = 0
+                    MD_toks    = parse_MD(MD)
+                    MD_tok_i   = 0
                     MD_len     = 0
                     Zs_pos     = 0
                     Zs_i       = 0
-                    for _i in range(len(Zs)):
-                        Zs[_i]    = Zs[_i].split('|')
-                        Zs[_i][0] = int(Zs[_i][0])
                     if Zs_i < len(Zs):
                         Zs_pos += Zs[Zs_i][0]
                     read_pos  = 0
                     left_pos  = pos
                     right_pos = left_pos
-                    cigars    = cigar_re.findall(cigar_str)
-                    cigars    = [[cigar[-1], int(cigar[:-1])] for cigar in cigars]
                     cmp_list  = []
                     num_error_correction = 0
                     likely_misalignment  = False
@@ -917,16 +1296,9 @@ def typing(simulation,
                             cmp_list_i = len(cmp_list)
                             while True:
                                 if not first or MD_len == 0:
-                                    if MD[MD_str_pos].isdigit():
-                                        num = int(MD[MD_str_pos])
-                                        MD_str_pos += 1
-                                        while MD_str_pos < len(MD):
-                                            if MD[MD_str_pos].isdigit():
-                                                num = num * 10 + int(MD[MD_str_pos])
-                                                MD_str_pos += 1
-                                            else:
-                                                break
-                                        MD_len += num
+                                    if isinstance(MD_toks[MD_tok_i], int):
+                                        MD_len   += MD_toks[MD_tok_i]
+                                        MD_tok_i += 1
                                 # Insertion or full match followed
                                 if MD_len >= length:
                                     MD_len -= length
@@ -937,9 +1309,10 @@ def typing(simulation,
                                     break
                                 first       = False
                                 read_base   = read_seq[read_pos + MD_len]
-                                MD_ref_base = MD[MD_str_pos]
-                                MD_str_pos += 1
-                                assert MD_ref_base in "ACGT"
+                                MD_ref_base = MD_toks[MD_tok_i]
+                                MD_tok_i   += 1
+                                if DEBUG_TYPING:
+                                    assert MD_ref_base in "ACGT"
                                 if MD_len > MD_len_used:
                                     cmp_list.append(["match", 
                                                      right_pos + MD_len_used, 
@@ -947,7 +1320,8 @@ def typing(simulation,
 
                                 _var_id = "unknown"
                                 if read_pos + MD_len == Zs_pos and Zs_i < len(Zs):
-                                    assert Zs[Zs_i][1] == 'S'
+                                    if DEBUG_TYPING:
+                                        assert Zs[Zs_i][1] == 'S'
                                     _var_id = Zs[Zs_i][2]
                                     Zs_i   += 1
                                     Zs_pos += 1
@@ -957,19 +1331,17 @@ def typing(simulation,
                                     # Search for a known (yet not indexed) 
                                     # variant or a novel variant
                                     ref_pos = right_pos + MD_len
-                                    var_idx = typing_common.lower_bound(gene_var_list, 
-                                                                        ref_pos)
-                                    while var_idx < len(gene_var_list):
-                                        var_pos, var_id = gene_var_list[var_idx]
-                                        if var_pos > ref_pos:
+                                    var_lo  = bisect.bisect_left(gene_var_positions, 
+                                                                 ref_pos)
+                                    var_hi  = bisect.bisect_right(gene_var_positions, 
+                                                                  ref_pos, 
+                                                                  var_lo)
+                                    for var_id, var_type, var_data, _ \
+                                            in gene_var_records[var_lo:var_hi]:
+                                        if var_type == "single" \
+                                                and var_data == read_base:
+                                            _var_id = var_id
                                             break
-                                        if var_pos == ref_pos:
-                                            var_type, _, var_data = gene_vars[var_id]
-                                            if var_type == "single" \
-                                                    and var_data == read_base:
-                                                _var_id = var_id
-                                                break
-                                        var_idx += 1
 
                                 cmp_list.append(["mismatch", 
                                                  right_pos + MD_len, 
@@ -986,26 +1358,33 @@ def typing(simulation,
                             # Correction for sequencing errors and 
                             # update for cmp_list
                             if error_correction:
-                                assert cmp_list_i < len(cmp_list)
+                                if DEBUG_TYPING:
+                                    assert cmp_list_i < len(cmp_list)
                                 name_readID = "aHSQ1008:175:C0JVFACXX:5:1109:17665:21583|L"
+                                if node_read_id == name_readID:
+                                    error_correct_read \
+                                        = functools.partial(error_correct_debug,
+                                                            mpileup = mpileup)
+                                else:
+                                    error_correct_read = error_correct
                                 new_cmp_list, \
                                   read_seq, \
                                   _num_error_correction \
-                                    = error_correct(ref_seq,
-                                                    read_seq,
-                                                    read_pos,
-                                                    mpileup,
-                                                    gene_vars,
-                                                    gene_var_list,
-                                                    cmp_list[cmp_list_i:],
-                                                    node_read_id == name_readID)
-                                cmp_list = cmp_list[:cmp_list_i] + new_cmp_list
+                                    = error_correct_read(ref_bytes,
+                                                         read_seq,
+                                                         read_pos,
+                                                         mpileup_nt_sets,
+                                                         gene_vars,
+                                                         gene_var_list,
+                                                         cmp_list[cmp_list_i:])
+                                cmp_list[cmp_list_i:] = new_cmp_list
                                 num_error_correction += _num_error_correction
 
                         elif cigar_op == 'I':
                             _var_id = "unknown"
                             if read_pos == Zs_pos and Zs_i < len(Zs):
-                                assert Zs[Zs_i][1] == 'I'
+                                if DEBUG_TYPING:
+                                    assert Zs[Zs_i][1] == 'I'
                                 _var_id = Zs[Zs_i][2]
                                 Zs_i += 1
                                 if Zs_i < len(Zs):
@@ -1013,35 +1392,30 @@ def typing(simulation,
                             else:
                                 # Search for a known (yet not indexed) 
                                 # variant or a novel variant
-                                var_idx = typing_common.lower_bound(gene_var_list, 
-                                                                    right_pos)
-                                while var_idx < len(gene_var_list):
-                                    var_pos, var_id = gene_var_list[var_idx]
-                                    if var_pos > right_pos:
+                                var_lo = bisect.bisect_left(gene_var_positions, 
+                                                            right_pos)
+                                var_hi = bisect.bisect_right(gene_var_positions, 
+                                                             right_pos, 
+                                                             var_lo)
+                                for var_id, var_type, _, var_len \
+                                        in gene_var_records[var_lo:var_hi]:
+                                    if var_type == "insertion" \
+                                            and var_len == length:
+                                        _var_id = var_id
                                         break
-                                    if var_pos == right_pos:
-                                        var_type, _, var_data = gene_vars[var_id]
-                                        if var_type == "insertion" \
-                                                and len(var_data) == length:
-                                            _var_id = var_id
-                                            break
-                                    var_idx += 1                            
                             cmp_list.append(["insertion", 
                                              right_pos, 
                                              length, 
                                              _var_id])
-                            if 'N' in read_seq[read_pos:read_pos+length]:
+                            if read_seq.find('N', read_pos, read_pos + length) >= 0:
                                 likely_misalignment = True
                                 
                         elif cigar_op == 'D':
-                            if MD[MD_str_pos] == '0':
-                                MD_str_pos += 1
-                            assert MD[MD_str_pos] == '^'
-                            MD_str_pos += 1
-                            while MD_str_pos < len(MD):
-                                if not MD[MD_str_pos] in "ACGT":
-                                    break
-                                MD_str_pos += 1
+                            if MD_toks[MD_tok_i] == 0:
+                                MD_tok_i += 1
+                            if DEBUG_TYPING:
+                                assert MD_toks[MD_tok_i][0] == '^'
+                            MD_tok_i += 1
                             _var_id = "unknown"
                             if read_pos == Zs_pos and \
                                Zs_i < len(Zs) and \
@@ -1053,19 +1427,17 @@ def typing(simulation,
                             else:
                                 # Search for a known (yet not indexed) variant 
                                 # or a novel variant
-                                var_idx = typing_common.lower_bound(gene_var_list, 
-                                                                    right_pos)
-                                while var_idx < len(gene_var_list):
-                                    var_pos, var_id = gene_var_list[var_idx]
-                                    if var_pos > right_pos:
+                                var_lo = bisect.bisect_left(gene_var_positions, 
+                                                            right_pos)
+                                var_hi = bisect.bisect_right(gene_var_positions, 
+                                                             right_pos, 
+                                                             var_lo)
+                                for var_id, var_type, _, var_len \
+                                        in gene_var_records[var_lo:var_hi]:
+                                    if var_type == "deletion" \
+                                            and var_len == length:
+                                        _var_id = var_id
                                         break
-                                    if var_pos == right_pos:
-                                        var_type, _, var_data = gene_vars[var_id]
-                                        if var_type == "deletion" \
-                                                and int(var_data) == length:
-                                            _var_id = var_id
-                                            break
-                                    var_idx += 1
 
                             cmp_list.append(["deletion", 
                                              right_pos, 
@@ -1073,19 +1445,11 @@ def typing(simulation,
                                              _var_id])
 
                             # Check if this deletion is artificial alignment
-                            if right_pos < len(mpileup):
-                                del_count, nt_count = 0, 0
-                                for nt, value in mpileup[right_pos][1].items():
-                                    count = value[0]
-                                    if nt == 'D':
-                                        del_count += count
-                                    else:
-                                        nt_count += count
-
-                                # DK - debugging purposes
-                                if base_fname == "hla":
-                                    if del_count * 6 < nt_count: 
-                                        likely_misalignment = True
+                            # DK - debugging purposes
+                            if base_fname == "hla" \
+                                    and right_pos < len(mpileup_weak_dels) \
+                                    and mpileup_weak_dels[right_pos]:
+                                likely_misalignment = True
                             
                         elif cigar_op == 'S':
                             if i == 0:
@@ -1105,29 +1469,19 @@ def typing(simulation,
                         if cigar_op in "MIS":
                             read_pos += length                    
                     
-                    # Remove softclip in cigar and modify read_seq and 
-                    # read_qual accordingly
+                    # Remove softclip from read_seq and read_qual; the CIGAR
+                    # is not consulted again, so it is not rebuilt
                     if sum(softclip) > 0:
                         if softclip[0] > 0:
-                            cigars = cigars[1:]
                             read_seq = read_seq[softclip[0]:]
                             read_qual = read_qual[softclip[0]:]
                         if softclip[1] > 0:
-                            cigars = cigars[:-1]
                             read_seq = read_seq[:-softclip[1]]
                             read_qual = read_qual[:-softclip[1]]
 
-                        cigar_str = ""
-                        for type, length in cigars:
-                            cigar_str += str(length)
-                            cigar_str += type
-
                     # if sum(softclip) > 0: #TODO Examine the purpose of this skip
                     #     continue
 
-                    if right_pos > len(ref_seq):
-                        continue
-
                     if num_error_correction > max(1, num_editdist):
                         continue
                         
@@ -1135,11 +1489,13 @@ def typing(simulation,
                         continue
 
                     # Add novel variants
-                    read_pos = 0
-                    for cmp_i in range(len(cmp_list)):
-                        type_, pos_, length_ = cmp_list[cmp_i][:3]
+                    read_pos     = 0
+                    novel_vars   = [] # [type, pos, data] not yet registered
+                    novel_cmps   = [] # cmp_list entries awaiting their ids
+                    for cmp in cmp_list:
+                        type_, pos_, length_ = cmp[0], cmp[1], cmp[2]
                         if type_ != "match":
-                            var_id_ = cmp_list[cmp_i][3]
+                            var_id_ = cmp[3]
                             if var_id_ == "unknown":
                                 add = True
                                 if type_ == "mismatch":
@@ -1156,96 +1512,30 @@ def typing(simulation,
                                         type_add = type_
                                     else:
                                         type_add = "single"
-
-                                    var_id_, novel_var_count \
-                                        = add_novel_var(gene_vars,
-                                                        gene_var_list,
-                                                        novel_var_count,
-                                                        type_add,
-                                                        pos_,
-                                                        data_)
-                                    cmp_list[cmp_i][3] = var_id_
-                            if var_id_ != "unknown":
-                                if var_id_ not in var_count:
-                                    var_count[var_id_] = 1
-                                else:
-                                    var_count[var_id_] += 1
+                                    novel_vars.append([type_add, pos_, data_])
+                                    novel_cmps.append(cmp)
+                            elif var_id_ not in var_count:
+                                var_count[var_id_] = 1
+                            else:
+                                var_count[var_id_] += 1
                                 
                         if type_ != "deletion":
                             read_pos += length_
 
+                    if novel_vars:
+                        novel_var_ids, novel_var_count \
+                            = add_novel_vars(gene_vars,
+                                             gene_var_list,
+                                             novel_var_count,
+                                             novel_vars)
+                        for cmp, var_id_ in zip(novel_cmps, novel_var_ids):
+                            cmp[3] = var_id_
+                            var_count[var_id_] = 1
+
                     # Count the number of reads aligned uniquely with 
                     # some constraints
                     num_reads += 1
 
-                    # Add count statistics to given gene information
-                    def add_stat(Gene_cmpt, 
-                                 Gene_counts, 
-                                 Gene_count_per_read, 
-                                 include_alleles = set()):
-                        if len(Gene_count_per_read) <= 0:
-                            return ""
-                        max_count = max(Gene_count_per_read.values())
-                        cur_cmpt = set()
-                        for allele, count in Gene_count_per_read.items():
-                            if count < max_count:
-                                continue
-                            if len(include_alleles) > 0 \
-                                    and allele not in include_alleles:
-                                continue
-                            
-                            cur_cmpt.add(allele)                    
-                            if allele not in Gene_counts:
-                                Gene_counts[allele] = 1
-                            else:
-                                Gene_counts[allele] += 1
-
-                        if len(cur_cmpt) == 0:
-                            return ""
-
-                        if verbose >= 2:
-                            alleles = ["", ""]
-                            allele1_found = False
-                            allele2_found = False
-                            if alleles[0] != "":
-                                for allele, count in Gene_count_per_read.items():
-                                    if count < max_count:
-                                        continue
-                                    if allele == alleles[0]:
-                                        allele1_found = True
-                                    elif allele == alleles[1]:
-                                        allele2_found = True
-                                if allele1_found != allele2_found:
-                                    print((alleles[0], 
-                                           Gene_count_per_read[alleles[0]]), 
-                                          file=sys.stderr)
-                                    print((alleles[1], 
-                                           Gene_count_per_read[alleles[1]]), 
-                                          file=sys.stderr)
-                                    if allele1_found:
-                                        print("%s\tread_id %s - %d vs. %d]" 
-                                               % (alleles[0], 
-                                                  prev_read_id, 
-                                                  max_count, 
-                                                  Gene_count_per_read[alleles[1]]), 
-                                              file=sys.stderr)
-                                    else:
-                                        print("%s\tread_id %s - %d vs. %d]" 
-                                               % (alleles[1], 
-                                                  prev_read_id, 
-                                                  max_count, 
-                                                  Gene_count_per_read[alleles[0]]), 
-                                              file=sys.stderr)
-
-                        cur_cmpt = sorted(list(cur_cmpt))
-                        cur_cmpt = '-'.join(cur_cmpt)
-                        if not cur_cmpt in Gene_cmpt:
-                            Gene_cmpt[cur_cmpt] = 1
-                        else:
-                            Gene_cmpt[cur_cmpt] += 1
-
-                        return cur_cmpt
-
                     if read_id != prev_read_id:
                         if prev_read_id != None:
                             num_pairs += 1
@@ -1258,14 +1548,17 @@ def typing(simulation,
                                                    right_positive_hts)
                             """
 
-                            for positive_ht \
-                                    in left_positive_hts | right_positive_hts:
+                            # Both sets are reset for the next pair below, so
+                            #   merge in place rather than building a union
+                            left_positive_hts |= right_positive_hts
+                            for positive_ht in left_positive_hts:
                                 
                                 primary_exon_hts \
                                     = get_exon_haplotypes(positive_ht, 
                                                           ref_primary_exons)
                                 for exon_ht in primary_exon_hts:
                                     add_count(Gene_primary_exons_count_per_read, 
+                                              primary_exon_count_mask, 
                                               exon_ht, 
                                               1)
                                 
@@ -1273,10 +1566,12 @@ def typing(simulation,
                                                                ref_exons)
                                 for exon_ht in exon_hts:
                                     add_count(Gene_exons_count_per_read, 
+                                              exon_count_mask, 
                                               exon_ht, 
                                               1)
                                 
                                 add_count(Gene_count_per_read, 
+                                          count_mask, 
                                           positive_ht, 
                                           1)                     
 
@@ -1307,9 +1602,7 @@ def typing(simulation,
                                                    simulation)
                             read_nodes    = []
                             read_var_list = []
-                            if simulation \
-                                    and verbose >= 2 \
-                                    and base_fname in ["hla", "codis"]:
+                            if debug_pairs:
                                 if cur_cmpt != "":
                                     cur_cmpt = cur_cmpt.split('-') 
                                 else:
@@ -1323,19 +1616,19 @@ def typing(simulation,
                                 # will show debug if needed
                                 debug_print = False
                                 if partial:
-                                    if not set(cur_cmpt) & set(test_Gene_names):
+                                    if debug_allele_names.isdisjoint(cur_cmpt):
                                         if cur_cmpt != "":
                                             debug_print = True
                                             debug_line = cur_cmpt
                                 else:
-                                    if not set(cur_cmpt_gen) & set(test_Gene_names):
+                                    if debug_allele_names.isdisjoint(cur_cmpt_gen):
                                         if cur_cmpt_gen != "":
                                             debug_print = True
                                             debug_line = cur_cmpt_gen                           
 
                                 if debug_print:
                                     print("%s are chosen instead of %s" 
-                                          % (debug_line, '-'.join(test_Gene_names)))
+                                          % (debug_line, debug_Gene_names))
                                     for prev_line in prev_lines:
                                         print("\t", prev_line)
 
@@ -1343,40 +1636,18 @@ def typing(simulation,
 
                         left_positive_hts  = set()
                         right_positive_hts = set()                  
-                        Gene_primary_exons_count_per_read = {}
-                        Gene_exons_count_per_read         = {}
-                        Gene_count_per_read               = {}
-                        for allele in Gene_names[gene]:
-                            if allele.find("BACKBONE") != -1:
-                                continue
-                            if base_fname == "genome" and allele.find("GRCh38") != -1:
-                                continue
-                            if allele in primary_exon_allele_rep_set:
-                                Gene_primary_exons_count_per_read[allele] = 0
-                            if allele in allele_rep_set:
-                                Gene_exons_count_per_read[allele] = 0
-                            Gene_count_per_read[allele] = 0
-
-                    prev_lines.append(line)
+                        Gene_primary_exons_count_per_read \
+                            = dict.fromkeys(primary_exon_count_alleles, 0)
+                        Gene_exons_count_per_read \
+                            = dict.fromkeys(exon_count_alleles, 0)
+                        Gene_count_per_read \
+                            = dict.fromkeys(count_alleles, 0)
+
+                    if debug_pairs:
+                        prev_lines.append(line)
 
                     # Remove mismatches due to unknown or novel variants
-                    cmp_list2 = []
-                    for cmp in cmp_list:
-                        cmp = deepcopy(cmp)
-                        type, pos, length = cmp[:3]
-                        if type == "match":
-                            if len(cmp_list2) > 0 and cmp_list2[-1][0] == "match":
-                                cmp_list2[-1][2] += length
-                            else:
-                                cmp_list2.append(cmp)
-                        elif type == "mismatch" and \
-                             (cmp[3] == "unknown" or cmp[3].startswith("nv")):
-                            if len(cmp_list2) > 0 and cmp_list2[-1][0] == "match":
-                                cmp_list2[-1][2] += 1
-                            else:
-                                cmp_list2.append(["match", pos, 1])
-                        else:
-                            cmp_list2.append(cmp)
+                    cmp_list2 = remove_unknown_mismatches(cmp_list)
                     
                     debug_iad = orig_read_id.startswith(
                         "HSQ1009:126:D0UUYACXX:4:2212:9787:80992#")
@@ -1394,29 +1665,31 @@ def typing(simulation,
                                                                 verbose,
                                                                 debug_iad)
 
-                    mid_ht = []
-                    for cmp in cmp_list2[cmp_list_left:cmp_list_right+1]:
-                        type = cmp[0]
-                        if type not in ["mismatch", "deletion", "insertion"]:
-                            continue                            
-                        var_id = cmp[3]
-                        mid_ht.append(var_id)
-
-                    for l in range(len(cmp_left_alts)):
-                        left_ht = cmp_left_alts[l].split('-')
-                        left_ht += mid_ht
-                        for r in range(len(cmp_right_alts)):
-                            right_ht = cmp_right_alts[r].split('-')
-                            ht = left_ht + right_ht
-                            if len(ht) <= 0:
-                                continue
-                            ht_str = '-'.join(ht)
-                            if is_left_read:
-                                left_positive_hts.add(ht_str)
-                            else:
-                                right_positive_hts.add(ht_str)
+                    mid_ht = tuple(cmp[3] 
+                                   for cmp in cmp_list2[cmp_list_left:cmp_list_right+1]
+                                     if cmp[0] in _VAR_CMP_TYPES)
+
+                    # Haplotypes are kept as (left, var_id, ..., right)
+                    #   tuples so that no one has to split them again
+                    #   Each alternative is split once, not once per pairing
+                    left_hts = []
+                    for alt in cmp_left_alts:
+                        alt = alt.split('-')
+                        left_hts.append((int(alt[0]),) + tuple(alt[1:]) + mid_ht)
+                    right_hts = []
+                    for alt in cmp_right_alts:
+                        alt = alt.split('-')
+                        right_hts.append(tuple(alt[:-1]) + (int(alt[-1]),))
+
+                    if is_left_read:
+                        positive_hts = left_positive_hts
+                    else:
+                        positive_hts = right_positive_hts
+                    for left_ht in left_hts:
+                        for right_ht in right_hts:
+                            positive_hts.add(left_ht + right_ht)
 
-                    if assembly:
+                    if locus_assembly:
                         # Construct multiple candidate realignments for CODIS
                         cmp_llist = []
                         if is_left_read:
@@ -1427,34 +1700,23 @@ def typing(simulation,
                         for ht in hts:
                             cmp_list = []
                             read_pos = 0
-                            vars_    = ht.split('-')
-                            left_    = int(vars_[0])
-                            vars_    = vars_[1:]
+                            left_    = ht[0]
+                            vars_    = ht[1:]
                             for var_i in range(len(vars_)):
                                 var_id = vars_[var_i]
                                 # ref_seq, read_seq
                                 if var_i == len(vars_) - 1:
-                                    right_ = int(var_id)
+                                    right_ = var_id
                                 else:
                                     var_type, var_pos, var_data = gene_vars[var_id]
                                     right_ = var_pos - 1
                                 
-                                for pos in range(left_, right_ + 1):
-                                    if read_seq[read_pos] != ref_seq[pos]:
-                                        if left_ < pos:
-                                            cmp_list.append(["match", 
-                                                             left_, 
-                                                             pos - left_])
-                                        cmp_list.append(["mismatch", 
-                                                         pos, 
-                                                         1, 
-                                                         "unknown"])
-                                        left_ = pos + 1
-                                    read_pos += 1                                    
-                                if left_ <= right_:
-                                    cmp_list.append(["match", 
-                                                     left_, 
-                                                     right_ - left_ + 1])
+                                cmp_list += get_ungapped_cmps(ref_seq,
+                                                              read_seq,
+                                                              read_pos,
+                                                              left_,
+                                                              right_)
+                                read_pos += max(0, right_ - left_ + 1)
                                     
                                 if var_i == len(vars_) - 1:
                                     left_ = right_ + 1
@@ -1493,9 +1755,14 @@ def typing(simulation,
                             read_pos        = 0  
                             cmp_i           = 0                                                      
                             read_node_pos   = -1
-                            read_node_seq   = []
-                            read_node_qual  = []
-                            read_node_var   = []
+                            # Every column is known up front: fill slices of
+                            #   preallocated lists instead of growing them
+                            node_len        = sum(cmp[2] for cmp in cmp_list 
+                                                    if cmp[0] != "intron")
+                            read_node_seq   = [''] * node_len
+                            read_node_qual  = [''] * node_len
+                            read_node_var   = [''] * node_len
+                            node_i          = 0
 
                             while cmp_i < len(cmp_list):
                                 cmp = cmp_list[cmp_i]
@@ -1503,40 +1770,33 @@ def typing(simulation,
                                 if type in ["match", "mismatch"]:
                                     if read_node_pos < 0:
                                         read_node_pos = ref_pos
+                                node_end = node_i + length
                                 if type == "match":
-                                    read_end        = read_pos + length
-                                    read_node_seq  += list(read_seq[read_pos:read_end])
-                                    read_node_qual += list(read_qual[read_pos:read_end])
-                                    read_node_var  += ([''] * length)
-                                    read_pos        = read_end
+                                    read_end = read_pos + length
+                                    read_node_seq[node_i:node_end]  = read_seq[read_pos:read_end]
+                                    read_node_qual[node_i:node_end] = read_qual[read_pos:read_end]
+                                    read_pos = read_end
                                 elif type == "mismatch":
-                                    var_id          = cmp[3]
-                                    read_base       = read_seq[read_pos]
-                                    qual            = read_qual[read_pos]
-                                    read_node_seq  += [read_base]
-                                    read_node_qual += [qual]
-                                    read_node_var  += [var_id]
-                                    read_pos       += 1
+                                    read_node_seq[node_i]  = read_seq[read_pos]
+                                    read_node_qual[node_i] = read_qual[read_pos]
+                                    read_node_var[node_i]  = cmp[3]
+                                    read_pos += 1
                                 elif type == "deletion":
-                                    var_id          = cmp[3]
-                                    del_len         = length
-                                    read_node_seq  += (['D'] * del_len)
-                                    read_node_qual += ([''] * del_len)
-                                    if len(read_node_seq) > len(read_node_var):
-                                        assert len(read_node_seq) \
-                                            == len(read_node_var) + del_len
-                                        read_node_var += ([var_id] * del_len)
+                                    read_node_seq[node_i:node_end] = 'D' * length
+                                    read_node_var[node_i:node_end] = [cmp[3]] * length
                                 elif type == "insertion":
-                                    var_id          = cmp[3]
-                                    ins_len         = length
-                                    ins_seq         = read_seq[read_pos:read_end]
-                                    read_node_seq  += ["I%s" % nt for nt in ins_seq]
-                                    read_node_qual += list(read_qual[read_pos:read_end])
-                                    read_node_var  += ([var_id] * ins_len)                                        
-                                    read_pos       += read_end
+                                    read_end = read_pos + length
+                                    read_node_seq[node_i:node_end] \
+                                        = ["I%s" % nt for nt in read_seq[read_pos:read_end]]
+                                    read_node_qual[node_i:node_end] = read_qual[read_pos:read_end]
+                                    read_node_var[node_i:node_end]  = [cmp[3]] * length
+                                    read_pos = read_end
                                 else:
                                     assert type == "intron"
+                                    node_end = node_i
+                                node_i = node_end
                                 cmp_i += 1
+                            assert node_i == len(read_node_seq)
 
                             read_nodes.append([node_read_id,
                                                cmp_list_i,
@@ -1552,6 +1812,9 @@ def typing(simulation,
 
                     prev_read_id   = read_id
                     prev_right_pos = right_pos
+                alignview_proc.stdout.close()
+                alignview_proc.wait()
+                bamview_proc.wait()
  
                 if prev_read_id != None:
                     num_pairs += 1
@@ -1561,19 +1824,23 @@ def typing(simulation,
                           right_positive_hts \
                             = choose_pairs(left_positive_hts, 
                                            right_positive_hts)                            
-                    for positive_ht in left_positive_hts | right_positive_hts:
+                    left_positive_hts |= right_positive_hts
+                    for positive_ht in left_positive_hts:
                         primary_exon_hts = get_exon_haplotypes(positive_ht, 
                                                                ref_primary_exons)
                         for exon_ht in primary_exon_hts:
                             add_count(Gene_primary_exons_count_per_read, 
+                                      primary_exon_count_mask, 
                                       exon_ht, 
                                       1)
                         exon_hts = get_exon_haplotypes(positive_ht, ref_exons)
                         for exon_ht in exon_hts:
                             add_count(Gene_exons_count_per_read, 
+                                      exon_count_mask, 
                                       exon_ht, 
                                       1)
                         add_count(Gene_count_per_read, 
+                                  count_mask, 
                                   positive_ht, 
                                   1)
 
@@ -1598,7 +1865,7 @@ def typing(simulation,
                     read_var_list = []
 
                 if num_reads <= 0:
-                    continue
+                    return locus_assembly
 
                 for f_ in msg_out:
                     print("\t\t\t%d reads and %d pairs are aligned" 
@@ -1613,8 +1880,7 @@ def typing(simulation,
                     else:
                         Gene_counts[allele] += 1
 
-                    cur_cmpt = sorted(list(alleles))
-                    cur_cmpt = '-'.join(cur_cmpt)
+                    cur_cmpt = '-'.join(sorted(alleles))
                     if not cur_cmpt in Gene_cmpt:
                         Gene_cmpt[cur_cmpt] = 1
                     else:
@@ -1623,10 +1889,11 @@ def typing(simulation,
                 prev_read_id = None
                 prev_AS      = None
                 alleles      = set()
-                for line in alignview_proc_str:
+                # Alignments are consumed line by line as they are produced
+                for line in alignview_proc.stdout:
                     if not complete["Align Return"]: # Confirm alingment return
                         complete["Align Return"] = True
-                    cols = line[:-1].split()
+                    cols = line.rstrip('\n').split('\t')
                     read_id, flag, allele = cols[:3]
                     flag = int(flag)
                     if flag & 0x4 != 0:
@@ -1637,10 +1904,10 @@ def typing(simulation,
                         continue
 
                     AS = None
-                    for i in range(11, len(cols)):
-                        col = cols[i]
-                        if col.startswith("AS"):
+                    for col in cols[11:]:
+                        if col[:2] == "AS": # AS:i:<score>, one per record
                             AS = int(col[5:])
+                            break
                     assert AS != None
                     if read_id != prev_read_id:
                         if alleles:
@@ -1654,12 +1921,21 @@ def typing(simulation,
                     prev_read_id = read_id
                     prev_AS = AS
                     alleles.add(allele)
+                alignview_proc.stdout.close()
+                alignview_proc.wait()
 
                 if alleles:
                     add_alleles(alleles)
 
-            Gene_counts = [[allele, count] for allele, count in Gene_counts.items()]
-            Gene_counts = sorted(Gene_counts, key = lambda x: x[1], reverse = True)
+            # Only the top 10 are reported unless all counts are asked for
+            if simulation or output_allele_counts:
+                Gene_counts = sorted(Gene_counts.items(), 
+                                     key = itemgetter(1), 
+                                     reverse = True)
+            else:
+                Gene_counts = heapq.nlargest(10, 
+                                             Gene_counts.items(), 
+                                             key = itemgetter(1))
             for count_i in range(len(Gene_counts)):
                 count = Gene_counts[count_i]
                 if simulation:
@@ -1705,23 +1981,12 @@ def typing(simulation,
                         if len(primary_allele_group) <= 1:
                             continue
                         primary_exon_prob_sum += prob
-                        primary_exon_alleles |= set(primary_allele_group)
+                        primary_exon_alleles.update(primary_allele_group)
 
                     # Incorporate representative alleles for exons
                     if len(primary_exon_alleles) > 0:
-                        Gene_exons_cmpt2 = {}
-                        for cmpt, value in Gene_exons_cmpt.items():
-                            cmpt2 = []
-                            for allele in cmpt.split('-'):
-                                if allele in primary_exon_alleles:
-                                    cmpt2.append(allele)
-                            if len(cmpt2) == 0:
-                                continue
-                            cmpt2 = '-'.join(cmpt2)
-                            if cmpt2 not in Gene_exons_cmpt2:
-                                Gene_exons_cmpt2[cmpt2] = value
-                            else:
-                                Gene_exons_cmpt2[cmpt2] += value
+                        Gene_exons_cmpt2 = filter_cmpts(Gene_exons_cmpt,
+                                                        primary_exon_alleles)
                         exon_prob = typing_common.single_abundance(
                             Gene_exons_cmpt2,
                             remove_low_abundance_alleles
@@ -1757,24 +2022,11 @@ def typing(simulation,
                         continue
 
                     exon_prob_sum += prob
-                    exon_alleles |= set(allele_rep_groups[allele])
+                    exon_alleles.update(allele_rep_groups[allele])
 
                 # Incorporate full-length alleles, non-representative alleles
                 if len(exon_alleles) > 0:
-                    Gene_cmpt2 = {}
-                    for cmpt, value in Gene_cmpt.items():
-                        cmpt2 = []
-                        for allele in cmpt.split('-'):
-                            if allele in exon_alleles:
-                                cmpt2.append(allele)
-                        if len(cmpt2) == 0:
-                            continue
-                        cmpt2 = '-'.join(cmpt2)
-                        if cmpt2 not in Gene_cmpt2:
-                            Gene_cmpt2[cmpt2] = value
-                        else:
-                            Gene_cmpt2[cmpt2] += value
-                    Gene_cmpt = Gene_cmpt2
+                    Gene_cmpt = filter_cmpts(Gene_cmpt, exon_alleles)
                     Gene_prob = typing_common.single_abundance(Gene_cmpt,
                                                                True,
                                                                Gene_lengths[gene])
@@ -1795,11 +2047,20 @@ def typing(simulation,
                 if len(Gene_cmpt.keys()) <= 1:
                     Gene_prob = []
                     if len(Gene_cmpt.keys()) == 1:
-                        Gene_prob = [[Gene_cmpt.keys()[0], 1.0]]
+                        Gene_prob = [[next(iter(Gene_cmpt)), 1.0]]
                 else:
                     Gene_prob = typing_common.single_abundance(Gene_cmpt)
 
-            if index_type == "graph" and assembly:
+            # Node var ids walk the node's sequence; compute them once per
+            #   node for both the coloring and the identification passes
+            node_var_ids = {}
+            def get_node_vars(node):
+                if node.id not in node_var_ids:
+                    node_vars             = node.get_var_ids()
+                    node_var_ids[node.id] = (node_vars, frozenset(node_vars))
+                return node_var_ids[node.id]
+
+            if index_type == "graph" and locus_assembly:
                 allele_node_order = []
                 predicted_allele_nodes = {}
                 for allele_name, prob in Gene_prob:
@@ -1815,7 +2076,7 @@ def typing(simulation,
                 asm_graph.calculate_coverage()
                 
                 # Start drawing assembly graph
-                fname = "%s.%s" % (report_base, gene)
+                fname = f"{report_base}.{gene}"
                 asm_graph.begin_draw(fname)
 
                 # Draw assembly graph
@@ -1839,7 +2100,7 @@ def typing(simulation,
                     asm_graph.end_draw()
                 
                 except Exception as err:
-                    assembly = False
+                    locus_assembly = False
                     for f_ in msg_out:
                         print("Error in building and calling viterbi", 
                               file=f_)
@@ -1855,185 +2116,175 @@ def typing(simulation,
                         file=sys.stderr)
                     asm_graph.print_node_comparison(asm_graph.true_allele_nodes)
 
+                # Format a line once and write it to every output
+                def emit(*args):
+                    line = ' '.join(map(str, args)) + '\n'
+                    for f_ in msg_out:
+                        f_.write(line)
+
+                # Exon holding pos, found by bisecting the sorted exon ends
+                ref_exon_lefts  = [exon_left for exon_left, _ in ref_exons]
+                ref_exon_rights = [exon_right for _, exon_right in ref_exons]
+                exon_tags       = ["\033[94mexon%d\033[00m" % (exon_i + 1)
+                                     for exon_i in range(len(ref_exons))]
+                def in_exon(pos):
+                    exon_i = bisect.bisect_left(ref_exon_rights, pos)
+                    return exon_i < len(ref_exons) \
+                            and ref_exon_lefts[exon_i] <= pos, exon_i
+
                 def compare_alleles(vars1, 
                                     vars2, 
                                     print_output = True):
                     skip       = True
                     var_i      = 0
                     var_j      = 0
-                    exon_i     = 0
                     mismatches = 0
-                    allele_seq = list(ref_seq)
+                    allele_seq = bytearray(ref_bytes) # edited in place
                     while var_i < len(vars1) and var_j < len(vars2):
                         cmp_var_id  = vars1[var_i]
                         node_var_id = vars2[var_j]
                         cmp_var     = gene_vars[cmp_var_id]
                         node_var    = gene_vars[node_var_id]
-                        min_pos     = min(cmp_var[1], node_var[1])
-
-                        cmp_var_in_exon  = False
-                        node_var_in_exon = False
-                        while exon_i < len(ref_exons):
-                            exon_left, exon_right = ref_exons[exon_i]
-                            if min_pos <= exon_right:
-                                if cmp_var[1] >= exon_left \
-                                        and cmp_var[1] <= exon_right:
-                                    cmp_var_in_exon = True
-                                else:
-                                    cmp_var_in_exon = False
-                                if node_var[1] >= exon_left \
-                                        and node_var[1] <= exon_right:
-                                    node_var_in_exon = True
-                                else:
-                                    node_var_in_exon = False                                
-                                break
-                            exon_i += 1
+                        cmp_type, cmp_pos, cmp_data = cmp_var
+                        node_pos    = node_var[1]
                         
+                        # Exons and pileups are only looked up for printing
                         if cmp_var_id == node_var_id:
                             skip = False
                             if print_output:
-                                for f_ in msg_out:
-                                    if cmp_var_in_exon:
-                                        print("\033[94mexon%d\033[00m" % (exon_i + 1), 
-                                            file=f_)
-                                    print(cmp_var_id, 
-                                        cmp_var, 
-                                        "\t\t\t", mpileup[cmp_var[1]], 
-                                        file=f_)
+                                cmp_var_in_exon, cmp_exon_i = in_exon(cmp_pos)
+                                if cmp_var_in_exon:
+                                    emit(exon_tags[cmp_exon_i])
+                                emit(cmp_var_id, cmp_var, "\t\t\t", mpileup[cmp_pos])
                             var_i += 1
                             var_j += 1
 
-                            var_type, var_pos, var_data = cmp_var
-                            if var_type == "single":
-                                allele_seq[var_pos] = var_data
-                            elif var_type == "deletion":
-                                var_data = int(var_data)
-                                allele_seq[var_pos:var_pos+var_data] = '.' * var_data
+                            if cmp_type == "single":
+                                allele_seq[cmp_pos] = ord(cmp_data)
+                            elif cmp_type == "deletion":
+                                del_len = int(cmp_data)
+                                allele_seq[cmp_pos:cmp_pos+del_len] = b'.' * del_len
                             else:
-                                assert var_type == "insertion"
+                                assert cmp_type == "insertion"
                             continue
-                        if cmp_var[1] <= node_var[1]:
+                        if cmp_pos <= node_pos:
                             if not skip:
                                 if (var_i > 0 and var_i + 1 < len(vars1)) \
-                                        or cmp_var[0] != "deletion":
+                                        or cmp_type != "deletion":
                                     if print_output:
+                                        cmp_var_in_exon, cmp_exon_i = in_exon(cmp_pos)
                                         if cmp_var_in_exon:
-                                            for f_ in msg_out:
-                                                print("\033[94mexon%d\033[00m" 
-                                                       % (exon_i + 1), 
-                                                      file=f_)
-                                        for f_ in msg_out:
+                                            emit(exon_tags[cmp_exon_i])
+                                        # This line has always gone to stderr,
+                                        #   once per output
+                                        for _ in msg_out:
                                             print("***", 
                                                     cmp_var_id, 
                                                     cmp_var, 
                                                     "==", 
                                                     "\t\t\t", 
-                                                    mpileup[cmp_var[1]], 
+                                                    mpileup[cmp_pos], 
                                                   file=sys.stderr)
                                     mismatches += 1
                             var_i += 1
                         else:
                             if print_output:
+                                node_var_in_exon, node_exon_i = in_exon(node_pos)
                                 if node_var_in_exon:
-                                    for f_ in msg_out:
-                                        print("\033[94mexon%d\033[00m" 
-                                               % (exon_i + 1), 
-                                              file=f_)
-                                for f_ in msg_out:
-                                    print("*** ==", 
-                                            node_var_id, 
-                                            node_var, 
-                                            "\t\t\t", 
-                                            mpileup[node_var[1]], 
-                                          file=f_)
+                                    emit(exon_tags[node_exon_i])
+                                emit("*** ==", 
+                                     node_var_id, 
+                                     node_var, 
+                                     "\t\t\t", 
+                                     mpileup[node_pos])
                             mismatches += 1
                             var_j += 1
 
                     allele_exons = ref_exons[:]
-                    allele_seq = ''.join(allele_seq)
-                    del_counts = []
-                    for del_i in range(len(allele_seq)):
-                        del_count = 0 if del_i == 0 else del_counts[-1]
-                        if allele_seq[del_i] == '.':
-                            del_count += 1
-                        del_counts.append(del_count)
+                    # Shift each exon end by the deleted bases up to and 
+                    #   including it; only the ends are needed, so count them
+                    #   directly rather than building a prefix sum per base
                     for exon_i in range(len(allele_exons)):
                         exon_left, exon_right = allele_exons[exon_i]
-                        exon_left            -= del_counts[exon_left]
-                        exon_right           -= del_counts[exon_right]
+                        exon_left            -= allele_seq.count(b'.', 0, exon_left + 1)
+                        exon_right           -= allele_seq.count(b'.', 0, exon_right + 1)
                         allele_exons[exon_i]  = [exon_left, exon_right]
                         
-                    allele_seq = allele_seq.replace('.', '')
+                    allele_seq = allele_seq.translate(None, b'.').decode("ascii")
                     return allele_seq, allele_exons, mismatches
                     
-                tmp_nodes = asm_graph.nodes
-                for f_ in msg_out:
-                    print("Number of tmp nodes:", len(tmp_nodes), 
-                        file=f_)
-                count = 0
-                for id, node in tmp_nodes.items():
-                    count += 1
-                    if count > 10:
-                        break
-                    node_vars = node.get_var_ids()
-                    for f_ in msg_out:
-                        node.print_info(f_)
-                        print("\n", file=f_)
-                        if node.id in asm_graph.to_node:
-                            for id2, at in asm_graph.to_node[node.id]:
-                                print("\tat %d ==> %s" % (at, id2), 
-                                    file=f_)
+                if msg_out:
+                    tmp_nodes = asm_graph.nodes
+                    emit("Number of tmp nodes:", len(tmp_nodes))
+                    count = 0
+                    for id, node in tmp_nodes.items():
+                        count += 1
+                        if count > 10:
+                            break
+                        node_vars, node_var_set = get_node_vars(node)
+                        for f_ in msg_out:
+                            node.print_info(f_)
+                            print("\n", file=f_)
+                            if node.id in asm_graph.to_node:
+                                for id2, at in asm_graph.to_node[node.id]:
+                                    print("\tat %d ==> %s" % (at, id2), 
+                                        file=f_)
 
-                    if simulation:
-                        cmp_Gene_names = test_Gene_names
-                    else:
-                        # List of allele names
-                        cmp_Gene_names = [aname for aname, _ in allele_node_order]
+                        if simulation:
+                            cmp_Gene_names = test_Gene_names
+                        else:
+                            # List of allele names
+                            cmp_Gene_names = [aname for aname, _ in allele_node_order]
                         
-                    alleles, cmp_vars, max_common = [], [], -sys.maxsize
-                    for cmp_Gene_name in cmp_Gene_names:
-                        tmp_vars \
-                            = allele_nodes[cmp_Gene_name].get_var_ids(node.left, 
-                                                                      node.right)
+                        # |A & B| - |A | B| == 2|A & B| - |A| - |B|
+                        alleles, cmp_vars, max_common = [], [], -sys.maxsize
+                        for cmp_Gene_name in cmp_Gene_names:
+                            tmp_vars \
+                                = allele_nodes[cmp_Gene_name].get_var_ids(node.left, 
+                                                                          node.right)
                         
-                        tmp_common  = len(set(node_vars) & set(tmp_vars))
-                        tmp_common -= len(set(node_vars) | set(tmp_vars))
-                        if max_common < tmp_common:
-                            max_common = tmp_common
-                            alleles = [[cmp_Gene_name, tmp_vars]]
-                        elif max_common == tmp_common:
-                            alleles.append([cmp_Gene_name, tmp_vars])
-
-                    for allele_name, cmp_vars in alleles:
-                        allele_seq, \
-                            allele_exons, \
-                            allele_mm \
-                            = compare_alleles(cmp_vars, node_vars)
-
-                        for f_ in msg_out:
-                            print("vs.", allele_name, 
-                                  file=f_)
-                            print("\t\tallele sequence (%d bps):" % len(allele_seq), 
-                                  allele_seq, 
-                                  file=f_)
-                            print("\t\texons (zero-based offset):", allele_exons, 
-                                  file=f_)
-
-                    for f_ in msg_out:
-                        print("\n\n", file=f_)
+                            tmp_var_set = set(tmp_vars)
+                            tmp_common  = 2 * len(node_var_set & tmp_var_set) \
+                                            - len(node_var_set) - len(tmp_var_set)
+                            if max_common < tmp_common:
+                                max_common = tmp_common
+                                alleles = [[cmp_Gene_name, tmp_vars]]
+                            elif max_common == tmp_common:
+                                alleles.append([cmp_Gene_name, tmp_vars])
+
+                        for allele_name, cmp_vars in alleles:
+                            allele_seq, \
+                                allele_exons, \
+                                allele_mm \
+                                = compare_alleles(cmp_vars, node_vars)
+
+                            emit("vs.", allele_name)
+                            emit("\t\tallele sequence (%d bps):" % len(allele_seq), 
+                                 allele_seq)
+                            emit("\t\texons (zero-based offset):", allele_exons)
+
+                        emit("\n\n")
 
             # Identify alleles that perfectly or closesly match assembled alleles
+            allele_var_sets = []
+            for allele_name, vars in allele_vars.items():
+                var_set = frozenset(vars)
+                allele_var_sets.append((allele_name, var_set, len(var_set)))
+            sorted_allele_names = set() # alleles whose vars are sorted by id
             fasta_dic  = {}
             contig_cnt = 0
             for node_name, node in asm_graph.nodes.items():
-                vars = set(node.get_var_ids())
+                node_vars, vars = get_node_vars(node)
 
                 fasta_key        = node_name + " " + "contig %d" % contig_cnt + " "
                 max_allele_names = []
                 max_common       = -sys.maxsize
-                for allele_name, vars2 in allele_vars.items():
-                    vars2 = set(vars2)
-                    tmp_common = len(vars & vars2) - len(vars | vars2)
+                vars_len         = len(vars)
+                for allele_name, vars2, vars2_len in allele_var_sets:
+                    # 2|A & B| - |A| - |B| is at most -||A| - |B||
+                    if max_common > -abs(vars_len - vars2_len):
+                        continue
+                    tmp_common = 2 * len(vars & vars2) - vars_len - vars2_len
                     if tmp_common > max_common:
                         max_common       = tmp_common
                         max_allele_names = [allele_name]                        
@@ -2043,16 +2294,17 @@ def typing(simulation,
                 for f_ in msg_out:
                     print("\tGenomic:", node_name, file=f_)
                     
-                node_vars      = node.get_var_ids()
                 min_mismatches = sys.maxsize
                 node_call      = ""
                 for max_allele_name in max_allele_names:
                     cmp_vars = allele_vars[max_allele_name]
-                    cmp_vars.sort(key=lambda x: int(x[2:]))
+                    if max_allele_name not in sorted_allele_names:
+                        cmp_vars.sort(key=typing_common.key_sortVar)
+                        sorted_allele_names.add(max_allele_name)
                     
-                    _, _, tmp_mismatches = compare_alleles(cmp_vars, 
-                                                            node_vars, 
-                                                            print_output = False)
+                    tmp_mismatches = count_mismatches(cmp_vars, 
+                                                      node_vars, 
+                                                      gene_vars)
                     for f_ in msg_out:
                         print("\t\t%s:" % max_allele_name, 
                               max_common, 
@@ -2087,8 +2339,8 @@ def typing(simulation,
             if simulation:
                 success = [False for i in range(len(test_Gene_names))]
                 found_list = [False for i in range(len(test_Gene_names))]
-            for prob_i in range(len(Gene_prob)):
-                prob = Gene_prob[prob_i]
+            top_Gene_prob = Gene_prob[:20 if simulation else 10]
+            for prob_i, prob in enumerate(top_Gene_prob):
                 if prob[1] < 0.01:
                     break
                 found = False
@@ -2125,11 +2377,6 @@ def typing(simulation,
                             print("SingleModel %s (abundance: %.2f%%)" 
                                    % (_allele_rep, prob[1] * 100.0), 
                                   file=f_)
-
-                if not simulation and prob_i >= 9:
-                    break
-                if prob_i >= 19:
-                    break
             print("\n", file=sys.stderr)
 
             # TODO - CB I can switch between full and partial success counting
@@ -2152,8 +2399,58 @@ def typing(simulation,
                     else:
                         test_passed[aligner_type] += 1
 
+            return locus_assembly
+
+        # Loci are typed serially unless HISATGT_INNER_THREADS=N asks for a
+        #   pool of N forked workers; threads keeps sizing the sample pool.
+        #   Forked workers share the read-only tables (Genes, Vars, Links...)
+        #   copy-on-write; each buffers its report lines so the report stays
+        #   in locus order. Pool workers are daemonic and cannot fork again,
+        #   so typing() already running under the sample pool stays serial.
+        num_locus_procs = min(int(os.environ.get("HISATGT_INNER_THREADS", 1)),
+                              len(locus_list))
+        locus_assemblies = []
+        if num_locus_procs > 1 and not multiprocessing.current_process().daemon:
+            def type_locus_buffered(test_Gene_names):
+                viterbi_calls.clear()
+                if simulation:
+                    test_passed.clear()
+                locus_msg = io.StringIO()
+                locus_assembly = type_locus(test_Gene_names, 
+                                            [locus_msg] if msg_out else [])
+                return (locus_msg.getvalue(), 
+                        complete, 
+                        viterbi_calls, 
+                        test_passed if simulation else {}, 
+                        locus_assembly)
+
+            # A failing locus re-raises here; leaving the block then 
+            #   terminates the remaining workers instead of orphaning them
+            with multiprocessing.get_context("fork").Pool(num_locus_procs,
+                                                          initializer=init_locus_worker,
+                                                          initargs=(type_locus_buffered,)) \
+                    as pool:
+                for locus_msg, locus_complete, locus_calls, locus_passed, locus_assembly \
+                        in pool.imap(run_locus_worker, locus_list):
+                    for f_ in msg_out:
+                        f_.write(locus_msg)
+                    for key, value in locus_complete.items():
+                        complete[key] = complete[key] or value
+                    viterbi_calls.update(locus_calls)
+                    for aligner_type, passed in locus_passed.items():
+                        test_passed[aligner_type] = test_passed.get(aligner_type, 0) + passed
+                    locus_assemblies.append(locus_assembly)
+        else:
+            for test_Gene_names in locus_list:
+                locus_assemblies.append(type_locus(test_Gene_names, msg_out))
+        assembly = assembly and all(locus_assemblies)
+
         if not keep_alignment and remove_alignment_file:
-            os.system("rm %s*" % (alignment_fname))
+            for fname in glob.glob(glob.escape(alignment_fname) + '*'):
+                try:
+                    os.unlink(fname)
+                except OSError:
+                    pass
 
     if assembly:
         for f_ in msg_out:
@@ -2169,6 +2466,8 @@ def typing(simulation,
                            % (genename), 
                           file=f_)
 
+    with open('%s.report' % report_base, "w") as report_out:
+        report_out.write(report_file.getvalue())
     report_file.close()
 
     # Check if all runs occured properly
@@ -2184,23 +2483,35 @@ def typing(simulation,
 """ Extract backbone allele sequence that is imbedded in the genotype_genome """
 """ Will load the sequences into the Genes dictionary """
 def read_backbone_alleles(genotype_genome, refGene_loci, Genes):
-    for gene_name in refGene_loci:
-        allele_name, chr, left, right = refGene_loci[gene_name][:4]
-        genome_loci = "%s:%d-%d" % (chr, left+1, right+1)
-        seq_extract_cmd = ["samtools", "faidx", "%s.fa" % genotype_genome, genome_loci]
-
-        length = right - left + 1
-        proc = subprocess.Popen(seq_extract_cmd, 
-                                universal_newlines = True,
-                                stdout = subprocess.PIPE, 
-                                stderr = open("/dev/null", 'w'))
-        seq = ""
-        for line in proc.stdout:
-            line = line.strip()
-            if line.startswith('>'):
-                continue
-            seq += line
-        assert len(seq) == length
+    gene_names = list(refGene_loci.keys())
+    if len(gene_names) == 0:
+        return
+
+    # One faidx run for all loci; records come back in argument order
+    genome_loci = []
+    for gene_name in gene_names:
+        _, chr, left, right = refGene_loci[gene_name][:4]
+        genome_loci.append("%s:%d-%d" % (chr, left+1, right+1))
+    seq_extract_cmd = ["samtools", "faidx", "%s.fa" % genotype_genome] + genome_loci
+
+    proc = subprocess.Popen(seq_extract_cmd, 
+                            universal_newlines = True,
+                            stdout = subprocess.PIPE, 
+                            stderr = subprocess.DEVNULL)
+    seqs = []
+    for line in proc.stdout:
+        if line.startswith('>'):
+            seqs.append([])
+            continue
+        seqs[-1].append(line.strip())
+    proc.stdout.close()
+    proc.wait()
+    assert len(seqs) == len(gene_names)
+
+    for gene_name, seq in zip(gene_names, seqs):
+        allele_name, _, left, right = refGene_loci[gene_name][:4]
+        seq = ''.join(seq)
+        assert len(seq) == right - left + 1
         assert gene_name not in Genes
         Genes[gene_name] = {}
         Genes[gene_name][allele_name] = seq
@@ -2224,25 +2535,25 @@ def read_Gene_alleles_from_vars(Vars, Var_list, Links, Genes):
                 allele_vars[allele_name].append(var_id)
 
         for allele_name, vars in allele_vars.items():
-            seq = ""
-            prev_pos = 0
+            seq_parts = [] # joined once the allele's variants are applied
+            prev_pos  = 0
             for var_id in vars:
                 type, pos, data = gene_vars[var_id]
                 assert prev_pos <= pos
                 if pos > prev_pos:
-                    seq += backbone_seq[prev_pos:pos]
+                    seq_parts.append(backbone_seq[prev_pos:pos])
                 if type == "single":
                     prev_pos = pos + 1
-                    seq += data
+                    seq_parts.append(data)
                 elif type == "deletion":
                     prev_pos = pos + int(data)
                 else:
                     assert type == "insertion"
-                    seq += data
+                    seq_parts.append(data)
                     prev_pos = pos
             if prev_pos < len(backbone_seq):
-                seq += backbone_seq[prev_pos:]
-            Genes[gene_name][allele_name] = seq
+                seq_parts.append(backbone_seq[prev_pos:])
+            Genes[gene_name][allele_name] = ''.join(seq_parts)
 
         if len(Genes[gene_name]) <= 1:
             Genes[gene_name]["%s*GRCh38" % gene_name] = backbone_seq
@@ -2254,21 +2565,42 @@ def read_Gene_vars_genotype_genome(fname, refGene_loci):
         allele_name, chr, left, right = values[:4]
         if chr not in loci:
             loci[chr] = []
-        loci[chr].append([allele_name, left, right])
+        loci[chr].append([len(loci[chr]), allele_name, left, right])
+
+    # Loci of each chromosome sorted by left end, with a prefix maximum of
+    #   right ends (as in IITree), so a position's loci are found by bisection
+    for chr, chr_loci in loci.items():
+        chr_loci.sort(key = lambda x: (x[2], x[0]))
+        loci[chr] = ([locus[2] for locus in chr_loci],
+                     list(itertools.accumulate((locus[3] for locus in chr_loci), max)),
+                     chr_loci)
+
+    # The first listed locus containing pos, or None
+    def find_locus(chr_loci, pos):
+        lefts, max_rights, chr_loci = chr_loci
+        locus = None
+        idx   = bisect.bisect_right(lefts, pos) - 1
+        while idx >= 0 and max_rights[idx] >= pos:
+            if chr_loci[idx][3] >= pos \
+                    and (locus is None or chr_loci[idx][0] < locus[0]):
+                locus = chr_loci[idx]
+            idx -= 1
+        return locus
         
+    # Most records fall outside the typed loci, so they are dropped 
+    #   before anything but the split is done for them
     Vars, Var_list = {}, {}
-    for line in open(fname):
+    snp_file = open(fname)
+    for line in snp_file:
         var_id, var_type, var_chr, pos, data = line.strip().split('\t')
         if var_chr not in loci:
             continue
         pos = int(pos)
-        found = False
-        for allele_name, left, right in loci[var_chr]:
-            if pos >= left and pos <= right:
-                found = True
-                break
-        if not found:
+        locus = find_locus(loci[var_chr], pos)
+        if locus is None:
             continue
+        _, allele_name, left, right = locus
+        var_id = sys.intern(var_id)
         
         gene = allele_name.split('*')[0]
         if not gene in Vars:
@@ -2279,6 +2611,7 @@ def read_Gene_vars_genotype_genome(fname, refGene_loci):
         assert not var_id in Vars[gene]
         Vars[gene][var_id] = [var_type, pos - left, data]
         Var_list[gene].append([pos - left, var_id])
+    snp_file.close()
         
     for gene, in_var_list in Var_list.items():
         Var_list[gene] = sorted(in_var_list)
@@ -2376,17 +2709,15 @@ def genotyping_locus(base_fname,
             print("Error: index files missing", file=sys.stderr)
             sys.exit(1)
 
-        # Read alleles
-        for line in open("%s.allele" % full_gg_path):
-            family, allele_name = line.strip().split('\t')
-            if family == base_fname:
-                alleles.add(allele_name)
-
-        # Read partial alleles
-        for line in open("%s.partial" % full_gg_path):
-            family, allele_name = line.strip().split('\t')
-            if family == base_fname:
-                partial_alleles.add(allele_name)
+        # Read alleles and partial alleles of this family
+        family_prefix = base_fname + '\t'
+        prefix_len    = len(family_prefix)
+        for fname, allele_set in [("%s.allele" % full_gg_path, alleles),
+                                  ("%s.partial" % full_gg_path, partial_alleles)]:
+            with open(fname) as ifi:
+                allele_set.update(line[prefix_len:].rstrip()
+                                    for line in ifi
+                                    if line.startswith(family_prefix))
         
         # Read alleles (names and sequences)
         typing_common.read_locus("%s.locus" % full_gg_path,
@@ -2424,13 +2755,13 @@ def genotyping_locus(base_fname,
                                                     index_type,
                                                     threads,
                                                     verbose >= 1)
-        # Read alleles
-        for line in open("%s.allele" % full_gg_path):
-            alleles.add(line.strip())
-        
-        # Read partial alleles
-        for line in open("%s.partial" % full_gg_path):
-            partial_alleles.add(line.strip())
+        # Read alleles and partial alleles, one name per line
+        for fname, allele_set in [("%s.allele" % full_gg_path, alleles),
+                                  ("%s.partial" % full_gg_path, partial_alleles)]:
+            with open(fname) as ifi:
+                allele_set.update(line.strip() 
+                                    for line in ifi.read().splitlines()
+                                    if line.strip())
 
         # Read alleles (names and sequences)
         if base_fname == "genome": # Reads refGene info from the locus list
@@ -2501,7 +2832,7 @@ def genotyping_locus(base_fname,
         pair_test   = False
         test_size   = 200
         ranseed     = None
-        test_passed = {}
+        test_passed = collections.Counter()
         test_list   = []
         if debug_instr:
             if "pair" in debug_instr:
@@ -2522,11 +2853,13 @@ def genotyping_locus(base_fname,
             elif pair_test:
                 allele_count = 2
 
-            for gene in genes:
-                Gene_gene_alleles = deepcopy(Gene_names[gene])
-                Gene_gene_alleles.remove(gene + "*BACKBONE")
+            random.seed(ranseed)
+            for gene in sorted(genes):
+                backbone_name     = gene + "*BACKBONE"
+                Gene_gene_alleles = [allele_name 
+                                       for allele_name in Gene_names[gene]
+                                       if allele_name != backbone_name]
 
-                random.seed(ranseed)
                 arr_loci = random.sample(range(len(Gene_gene_alleles)), 
                                          test_size * allele_count)
 
@@ -2541,6 +2874,13 @@ def genotyping_locus(base_fname,
                         test_set.append(sorted([allele_1, allele_2]))
                     test_list[int(arr_i/allele_count)] += test_set
 
+        # simulate_reads writes the same read files for every test
+        if "single-end" in debug_instr:
+            read_fname = ["%s_input_1.fa" % base_fname]
+        else:
+            read_fname = ["%s_input_1.fa" % base_fname, 
+                          "%s_input_2.fa" % base_fname]
+
         for test_i in range(len(test_list)):
             if "test_id" in debug_instr:
                 test_ids = debug_instr["test_id"].split('-')
@@ -2564,30 +2904,25 @@ def genotyping_locus(base_fname,
                                                          test_i)
 
             assert len(num_frag_list) == len(test_locus_list)
+            test_lines = [] # written to stderr at once
             for i_ in range(len(test_locus_list)):
                 test_Gene_names = test_locus_list[i_]
                 num_frag_list_i = num_frag_list[i_]
                 assert len(num_frag_list_i) == len(test_Gene_names)
                 for j_ in range(len(test_Gene_names)):
                     test_Gene_name = test_Gene_names[j_]
-                    gene = test_Gene_name.split('*')[0]
+                    gene = test_Gene_name.partition('*')[0]
                     test_Gene_seq = Genes[gene][test_Gene_name]
                     if test_Gene_name in partial_alleles:
                         seq_type = "partial" 
                     else: 
                         seq_type = "full"
-                    print("\t%s - %d bp (%s sequence, %d pairs)" 
-                           % (test_Gene_name, 
-                              len(test_Gene_seq), 
-                              seq_type, 
-                              num_frag_list_i[j_]), 
-                          file=sys.stderr)
-
-            if "single-end" in debug_instr:
-                read_fname = ["%s_input_1.fa" % base_fname]
-            else:
-                read_fname = ["%s_input_1.fa" % base_fname, 
-                              "%s_input_2.fa" % base_fname]
+                    test_lines.append("\t%s - %d bp (%s sequence, %d pairs)\n" 
+                                        % (test_Gene_name, 
+                                           len(test_Gene_seq), 
+                                           seq_type, 
+                                           num_frag_list_i[j_]))
+            sys.stderr.write(''.join(test_lines))
 
             fastq = False
             tmp_test_passed = typing(simulation,
@@ -2629,33 +2964,28 @@ def genotyping_locus(base_fname,
                                      output_allele_counts,
                                      test_i)
 
-            didpass = False
-            for aligner_type, passed in tmp_test_passed.items():
-                if aligner_type in test_passed:
-                    test_passed[aligner_type] += passed
-                else:
-                    test_passed[aligner_type] = passed
-
-                didpass = True
-
-            if didpass:
-                print("\t\tPassed so far: %d/%d (%.2f%%)" 
-                       % (test_passed[aligner_type], 
-                          ((test_i + 1) * allele_count * len(genes)), 
-                          (test_passed[aligner_type] * 100.0 \
-                              / ((test_i + 1) * allele_count * len(genes)))), 
-                       file=sys.stderr)
+            test_passed.update(tmp_test_passed)
+            if tmp_test_passed:
+                num_tested = (test_i + 1) * allele_count * len(genes)
+                for aligner_type in tmp_test_passed:
+                    passed = test_passed[aligner_type]
+                    print("\t\tPassed so far: %d/%d (%.2f%%)" 
+                           % (passed, 
+                              num_tested, 
+                              passed * 100.0 / num_tested), 
+                           file=sys.stderr)
             else:
                 print("\t\tTest Failed!",
                       file=sys.stderr)
 
 
+        num_tests = len(test_list) * allele_count * len(genes)
         for aligner_type, passed in test_passed.items():
             print("%s:\t%d/%d passed (%.2f%%)" 
                    % (aligner_type, 
                       passed, 
-                      len(test_list) * allele_count * len(genes), 
-                      passed * 100.0 / (len(test_list) * allele_count * len(genes))), 
+                      num_tests, 
+                      passed * 100.0 / num_tests), 
                   file=sys.stderr)
     
     else: # With real reads or BAMs
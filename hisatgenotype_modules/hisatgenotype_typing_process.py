@@ -1163,7 +1163,7 @@ def extract_vars(base_fname,
             cur_vars   = set(keys[i:j]) - excluded_vars
             for allele in alleles:
                 allele_vars = set(Vars_[allele]) - excluded_vars
-                allele_var_sort = sorted(list(cur_vars & allele_vars), 
+                allele_var_sort = sorted(cur_vars & allele_vars, 
                                          key=key_varKey)
                 if SANITY_CHECK:
                     validation_check.validate_variants(allele_var_sort)
@@ -1174,7 +1174,7 @@ def extract_vars(base_fname,
             if not whole_haplotype:
                 haplotypes = split_haplotypes(haplotypes, intra_gap)
 
-            haplotypes = sorted(list(haplotypes), key = hapKey)
+            haplotypes = sorted(haplotypes, key = hapKey)
             if SANITY_CHECK: # SANITY CHECK for sorting
                 validation_check.validate_haplotype(haplotypes)
 